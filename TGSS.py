@@ -1,27 +1,89 @@
 import os
+import argparse
+import sys
 import json
 import time
 import csv
 import sqlite3
-import schedule
+import shutil
+import hashlib
+import signal
+import random
 import asyncio
-import openpyxl
-from datetime import datetime, timedelta
-from telethon import TelegramClient
-from telethon.tl.functions.stories import GetAllStoriesRequest
-from telethon.tl.types import MessageMediaPhoto, MessageMediaDocument
-from rich.console import Console
-from rich.panel import Panel
-from rich.progress import Progress, SpinnerColumn, TextColumn, BarColumn, TaskProgressColumn
-from rich.prompt import Prompt, IntPrompt
-from rich.table import Table
-from rich import box
-from rich.align import Align
-
-console = Console()
+import subprocess
+import cProfile
+import threading
+import bisect
+import itertools
+from array import array
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from queue import Empty
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+class LazyConsole:
+    """Rich console that is only imported and created when first used"""
+
+    def __init__(self):
+        object.__setattr__(self, '_console', None)
+
+    def _get(self):
+        if self._console is None:
+            from rich.console import Console
+            object.__setattr__(self, '_console', Console())
+        return self._console
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._get(), name, value)
+
+console = LazyConsole()
+
+TelegramClient = FloodWaitError = GetAllStoriesRequest = None
+MessageMediaPhoto = MessageMediaDocument = Document = AllStoriesNotModified = None
+
+def load_telethon():
+    """Import Telethon on first use so exports and statistics start without it"""
+    global TelegramClient, FloodWaitError, GetAllStoriesRequest
+    global MessageMediaPhoto, MessageMediaDocument, Document, AllStoriesNotModified
+    from telethon import TelegramClient
+    from telethon.errors import FloodWaitError
+    from telethon.tl.functions.stories import GetAllStoriesRequest
+    from telethon.tl.types import MessageMediaPhoto, MessageMediaDocument, Document
+    from telethon.tl.types.stories import AllStoriesNotModified
+
+class NullProgress:
+    """Stand-in for rich Progress when nothing should be drawn"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add_task(self, *args, **kwargs):
+        return 0
+
+    def update(self, *args, **kwargs):
+        pass
+
+    def advance(self, *args, **kwargs):
+        pass
+
+# Offset applied when showing story times; stories are stored as UTC epoch seconds
+UTC_OFFSET = timedelta(hours=2)
 
 def display_banner():
     """Display the application banner"""
+    from rich import box
+    from rich.panel import Panel
     console.print(Panel("""[bold magenta]
 ████████╗ ██████╗ ███████╗███████╗ 
 ╚══██╔══╝██╔════╝ ██╔════╝██╔════╝ 
@@ -38,6 +100,8 @@ def display_banner():
 
 def display_export_banner():
     """Display the export menu banner"""
+    from rich import box
+    from rich.panel import Panel
     console.print(Panel("""[bold cyan]
 ╔═══════════════════════════════════════════════════════════════════════════╗
 ║                            EXPORT DATA MENU                               ║
@@ -45,6 +109,1033 @@ def display_export_banner():
     box=box.DOUBLE_EDGE,
     border_style="bright_blue"))
 
+def hash_file(path, chunk_size=1024 * 1024):
+    """Return the SHA-256 hex digest and size of a file, read in chunks"""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+def link_file(source, destination):
+    """Hardlink destination to source, copying where hardlinks are unsupported"""
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp'}
+
+def perceptual_hash(image, hash_size=8):
+    """Return the 64-bit difference hash of a Pillow image as hex"""
+    small = image.convert('L').resize((hash_size + 1, hash_size))
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f"{bits:016x}"
+
+def process_media_file(path, thumbnail_dir, thumbnail_size=320, transcode=False):
+    """Build a thumbnail, perceptual hash and optional smaller re-encode of a media file
+
+    Runs in a worker process; images need Pillow and videos need ffmpeg on PATH.
+    """
+    result = {}
+    try:
+        from PIL import Image
+
+        os.makedirs(thumbnail_dir, exist_ok=True)
+        base = os.path.splitext(os.path.basename(path))[0]
+        thumbnail = os.path.join(thumbnail_dir, f"{base}.jpg")
+        ext = os.path.splitext(path)[1].lower()
+
+        if ext in IMAGE_EXTENSIONS:
+            with Image.open(path) as image:
+                result['phash'] = perceptual_hash(image)
+                image = image.convert('RGB')
+                image.thumbnail((thumbnail_size, thumbnail_size))
+                image.save(thumbnail, 'JPEG', quality=80)
+        else:
+            ffmpeg = shutil.which('ffmpeg')
+            if not ffmpeg:
+                raise RuntimeError("ffmpeg not found")
+            # Clips shorter than a second have no frame to seek to, so fall back to the first one
+            for seek in ('1', '0'):
+                if os.path.exists(thumbnail):
+                    os.remove(thumbnail)
+                completed = subprocess.run([ffmpeg, '-v', 'error', '-y', '-ss', seek, '-i', path, '-frames:v', '1',
+                                            '-vf', f"scale={thumbnail_size}:-2", thumbnail],
+                                           capture_output=True)
+                if completed.returncode == 0 and os.path.exists(thumbnail):
+                    break
+            else:
+                raise RuntimeError(completed.stderr.decode(errors='replace').strip() or "ffmpeg wrote no frame")
+            with Image.open(thumbnail) as frame:
+                result['phash'] = perceptual_hash(frame)
+            if transcode:
+                transcoded = os.path.join(thumbnail_dir, f"{base}.small.mp4")
+                subprocess.run([ffmpeg, '-v', 'error', '-y', '-i', path, '-c:v', 'libx264', '-preset', 'veryfast',
+                                '-crf', '30', '-vf', 'scale=-2:min(720\\,ih)', '-c:a', 'aac', '-b:a', '64k',
+                                transcoded], check=True, capture_output=True)
+                result['transcoded'] = transcoded
+
+        result['thumbnail'] = thumbnail
+    except Exception as e:
+        result['error'] = str(e)
+    return result
+
+class MediaProcessor:
+    """Feeds finished downloads to a process pool without holding up the download loop"""
+
+    def __init__(self, db, metrics, workers=2, queue_size=64, thumbnail_dir='stories/thumbnails', transcode=False):
+        self.db = db
+        self.metrics = metrics
+        self.workers = workers
+        self.queue_size = queue_size
+        self.thumbnail_dir = thumbnail_dir
+        self.transcode = transcode
+        self.pool = None
+        self.loop = None
+        self.queue = None
+        self.consumers = []
+
+    def ensure_started(self):
+        """Start the pool and consumers on the running event loop"""
+        loop = asyncio.get_running_loop()
+        if self.loop is loop:
+            return
+        if self.pool is None:
+            from concurrent.futures import ProcessPoolExecutor
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.consumers = [asyncio.create_task(self.consume()) for _ in range(self.workers)]
+        # Files queued when a previous run stopped are picked up again here
+        for filename in self.db.claim_deferred_processing(self.queue_size, ('deferred', 'queued')):
+            self.queue.put_nowait(filename)
+
+    def submit(self, filename):
+        """Queue a file for processing, deferring it to a later cycle when the queue is full"""
+        self.ensure_started()
+        try:
+            self.queue.put_nowait(filename)
+        except asyncio.QueueFull:
+            self.db.mark_processing_deferred(filename)
+            self.metrics.inc('processing_deferred')
+        self.metrics.set('processing_queue_depth', self.queue.qsize())
+
+    async def consume(self):
+        """Process queued files in the pool until cancelled"""
+        while True:
+            filename = await self.queue.get()
+            try:
+                with self.metrics.timer('processing'):
+                    result = await self.loop.run_in_executor(
+                        self.pool, process_media_file, filename, self.thumbnail_dir, 320, self.transcode
+                    )
+                self.db.save_processing_result(filename, result)
+                self.metrics.inc('processing_errors' if result.get('error') else 'processed_files')
+            except Exception as e:
+                console.print(f"[red]Error processing {filename}: {str(e)}[/red]")
+                self.metrics.inc('processing_errors')
+            finally:
+                self.queue.task_done()
+
+            if self.queue.empty():
+                try:
+                    for deferred in self.db.claim_deferred_processing(self.queue_size):
+                        self.queue.put_nowait(deferred)
+                except Exception as e:
+                    console.print(f"[red]Error picking up deferred processing: {str(e)}[/red]")
+
+    async def close(self, timeout=None):
+        """Finish queued work, then stop the consumers and the pool"""
+        if self.queue is not None and self.loop is asyncio.get_running_loop():
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout)
+            except asyncio.TimeoutError:
+                while not self.queue.empty():
+                    self.db.mark_processing_deferred(self.queue.get_nowait())
+                    self.queue.task_done()
+            for consumer in self.consumers:
+                consumer.cancel()
+            await asyncio.gather(*self.consumers, return_exceptions=True)
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.pool = None
+        self.loop = None
+
+class OutputRenderer:
+    """Collects scraper events and writes them from a background thread at a low, fixed rate"""
+
+    def __init__(self, interval=2.0, quiet=False):
+        self.interval = interval
+        self.quiet = quiet
+        self.events = deque()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """Start the render thread if it is not running"""
+        if self.thread is None or not self.thread.is_alive():
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self.run, name='tgss-output', daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """Stop the render thread and write whatever is still queued"""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.render()
+
+    def downloaded(self, filename):
+        self.events.append(('downloaded', filename))
+
+    def note(self, message):
+        self.events.append(('note', message))
+
+    def error(self, message):
+        self.events.append(('error', message))
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.render()
+
+    def render(self):
+        """Write queued messages, folding per-file downloads into one summary line"""
+        downloads = 0
+        latest = None
+        while self.events:
+            kind, message = self.events.popleft()
+            if kind == 'downloaded':
+                downloads += 1
+                latest = message
+                continue
+            if downloads and not self.quiet:
+                console.print(f"[green]Downloaded:[/green] {downloads} stories (latest {latest})")
+                downloads = 0
+            if kind == 'error':
+                console.print(f"[red]{message}[/red]")
+            elif not self.quiet:
+                console.print(message)
+        if downloads and not self.quiet:
+            console.print(f"[green]Downloaded:[/green] {downloads} stories (latest {latest})")
+
+class Metrics:
+    """Counters, gauges and timings for the scraper, renderable as Prometheus text"""
+
+    def __init__(self, prefix='tgss'):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.gauges = {}
+        self.timings = defaultdict(lambda: [0, 0.0, 0.0])
+        self.cycle = {}
+
+    def inc(self, name, value=1):
+        """Increase a counter"""
+        with self.lock:
+            self.counters[name] += value
+            self.cycle[name] = self.cycle.get(name, 0) + value
+
+    def set(self, name, value):
+        """Set a gauge"""
+        with self.lock:
+            self.gauges[name] = value
+
+    def observe(self, name, seconds):
+        """Record a duration in seconds"""
+        with self.lock:
+            timing = self.timings[name]
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+            key = f"{name}_seconds"
+            self.cycle[key] = self.cycle.get(key, 0) + seconds
+
+    @contextmanager
+    def timer(self, name):
+        """Time the enclosed block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def start_cycle(self):
+        """Reset the per-cycle record"""
+        with self.lock:
+            self.cycle = {}
+
+    def cycle_record(self):
+        """Return this cycle's counters and timings"""
+        with self.lock:
+            return dict(self.cycle)
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE {self.prefix}_{name}_total counter")
+                lines.append(f"{self.prefix}_{name}_total {value}")
+            for name, value in sorted(self.gauges.items()):
+                lines.append(f"# TYPE {self.prefix}_{name} gauge")
+                lines.append(f"{self.prefix}_{name} {value}")
+            for name, (count, total, peak) in sorted(self.timings.items()):
+                lines.append(f"# TYPE {self.prefix}_{name}_seconds summary")
+                lines.append(f"{self.prefix}_{name}_seconds_count {count}")
+                lines.append(f"{self.prefix}_{name}_seconds_sum {total:.6f}")
+                lines.append(f"# TYPE {self.prefix}_{name}_seconds_max gauge")
+                lines.append(f"{self.prefix}_{name}_seconds_max {peak:.6f}")
+        return "\n".join(lines) + "\n"
+
+def start_metrics_server(metrics, port, host='127.0.0.1'):
+    """Serve metrics.render() at /metrics from a background thread"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='tgss-metrics', daemon=True).start()
+    return server
+
+class StoryDatabase:
+    """Single long-lived SQLite connection with batched story inserts"""
+
+    PRAGMAS = (
+        'PRAGMA journal_mode=WAL',
+        'PRAGMA synchronous=NORMAL',
+        'PRAGMA temp_store=MEMORY',
+        'PRAGMA cache_size=-16000',
+        'PRAGMA mmap_size=134217728',
+    )
+
+    SCHEMA_VERSION = 1
+    DISPLAY_OFFSET = int(UTC_OFFSET.total_seconds())
+
+    def __init__(self, db_file, batch_size=200, flush_interval=5.0):
+        self.db_file = db_file
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.pending_metadata = []
+        self.last_flush = time.monotonic()
+        self.metrics = None
+        self.conn = sqlite3.connect(db_file)
+        for pragma in self.PRAGMAS:
+            self.conn.execute(pragma)
+        self.initialize()
+
+    def initialize(self):
+        """Create the schema, migrating databases written by older versions"""
+        version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        legacy = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'stories'"
+        ).fetchone()
+
+        with self.conn:
+            self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS media (
+                media_key TEXT PRIMARY KEY,
+                path TEXT,
+                sha256 TEXT,
+                size INTEGER
+            )
+            ''')
+            self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS partial_downloads (
+                part_file TEXT PRIMARY KEY,
+                offset INTEGER
+            )
+            ''')
+            self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS account_peers (
+                account TEXT,
+                user_id INTEGER,
+                PRIMARY KEY (user_id, account)
+            )
+            ''')
+            self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS sync_state (
+                name TEXT PRIMARY KEY,
+                value TEXT
+            )
+            ''')
+            self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS export_partitions (
+                target TEXT,
+                partition TEXT,
+                row_count INTEGER,
+                checksum INTEGER,
+                PRIMARY KEY (target, partition)
+            )
+            ''')
+            self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS export_cursors (
+                target TEXT PRIMARY KEY,
+                last_rowid INTEGER,
+                row_count INTEGER,
+                size INTEGER
+            )
+            ''')
+            self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS media_processing (
+                filename TEXT PRIMARY KEY,
+                status TEXT,
+                thumbnail TEXT,
+                phash TEXT,
+                transcoded TEXT,
+                error TEXT
+            )
+            ''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_media_sha256 ON media (sha256)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_processing_phash ON media_processing (phash)')
+            self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS story_metadata (
+                user_id INTEGER NOT NULL,
+                story_id INTEGER NOT NULL,
+                media_type TEXT,
+                mime_type TEXT,
+                size INTEGER,
+                duration REAL,
+                views INTEGER,
+                expires INTEGER,
+                caption TEXT,
+                extra TEXT,
+                PRIMARY KEY (user_id, story_id)
+            )
+            ''')
+            self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS missed_stories (
+                user_id INTEGER NOT NULL,
+                story_id INTEGER NOT NULL,
+                expires INTEGER,
+                PRIMARY KEY (user_id, story_id)
+            )
+            ''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_processing_status ON media_processing (status)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_metadata_type_size ON story_metadata (media_type, size)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_metadata_size ON story_metadata (size)')
+
+        if version < self.SCHEMA_VERSION:
+            self.migrate_stories(legacy_table=bool(legacy))
+
+    def create_stories_schema(self):
+        """Create the stories table, its indexes and the rollup tables kept by triggers"""
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS stories (
+            user_id INTEGER NOT NULL,
+            story_id INTEGER NOT NULL,
+            timestamp INTEGER,
+            filename TEXT,
+            media_key TEXT,
+            PRIMARY KEY (user_id, story_id)
+        )
+        ''')
+        self.conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_stories_timestamp ON stories (timestamp, user_id, story_id, filename)'
+        )
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS daily_rollup (
+            day TEXT,
+            user_id INTEGER,
+            stories INTEGER,
+            PRIMARY KEY (day, user_id)
+        )
+        ''')
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_rollup (
+            user_id INTEGER PRIMARY KEY,
+            stories INTEGER,
+            last_timestamp INTEGER
+        )
+        ''')
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS story_totals (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            total_stories INTEGER,
+            unique_users INTEGER,
+            last_timestamp INTEGER
+        )
+        ''')
+
+    def create_rollup_trigger(self):
+        """Keep the rollup tables current as stories are inserted"""
+        self.conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS stories_rollup AFTER INSERT ON stories
+        BEGIN
+            UPDATE story_totals
+            SET total_stories = total_stories + 1,
+                unique_users = unique_users + NOT EXISTS (SELECT 1 FROM user_rollup WHERE user_id = NEW.user_id),
+                last_timestamp = MAX(COALESCE(last_timestamp, NEW.timestamp), NEW.timestamp)
+            WHERE id = 1;
+            INSERT INTO user_rollup (user_id, stories, last_timestamp) VALUES (NEW.user_id, 1, NEW.timestamp)
+            ON CONFLICT (user_id) DO UPDATE
+            SET stories = stories + 1, last_timestamp = MAX(last_timestamp, excluded.last_timestamp);
+            INSERT INTO daily_rollup (day, user_id, stories)
+            VALUES ({self.local_date('NEW.timestamp')}, NEW.user_id, 1)
+            ON CONFLICT (day, user_id) DO UPDATE SET stories = stories + 1;
+        END
+        ''')
+
+    def migrate_stories(self, legacy_table):
+        """Move stories to the composite-key, epoch-timestamp schema and rebuild the rollups"""
+        self.conn.execute('BEGIN')
+        try:
+            if legacy_table:
+                self.ensure_column('stories', 'media_key', 'TEXT')
+                self.conn.execute('ALTER TABLE stories RENAME TO stories_legacy')
+            self.create_stories_schema()
+            if legacy_table:
+                # Legacy timestamps are local (UTC+2) text; store them as UTC epoch seconds.
+                self.conn.execute(f'''
+                INSERT OR IGNORE INTO stories (user_id, story_id, timestamp, filename, media_key)
+                SELECT user_id, story_id, CAST(strftime('%s', timestamp) AS INTEGER) - {self.DISPLAY_OFFSET},
+                       filename, media_key
+                FROM stories_legacy
+                ORDER BY timestamp
+                ''')
+                self.conn.execute('DROP TABLE stories_legacy')
+
+            self.conn.execute('DELETE FROM daily_rollup')
+            self.conn.execute('DELETE FROM user_rollup')
+            self.conn.execute(f'''
+            INSERT INTO daily_rollup (day, user_id, stories)
+            SELECT {self.local_date('timestamp')}, user_id, COUNT(*) FROM stories GROUP BY 1, 2
+            ''')
+            self.conn.execute('''
+            INSERT INTO user_rollup (user_id, stories, last_timestamp)
+            SELECT user_id, COUNT(*), MAX(timestamp) FROM stories GROUP BY user_id
+            ''')
+            self.conn.execute('''
+            INSERT OR REPLACE INTO story_totals (id, total_stories, unique_users, last_timestamp)
+            SELECT 1, (SELECT COUNT(*) FROM stories), (SELECT COUNT(*) FROM user_rollup),
+                   (SELECT MAX(timestamp) FROM stories)
+            ''')
+            self.create_rollup_trigger()
+            self.conn.execute(f'PRAGMA user_version = {self.SCHEMA_VERSION}')
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+    def local_time(self, column):
+        """SQL expression formatting an epoch column as local YYYY-MM-DD HH:MM:SS text"""
+        return f"datetime({column} + {self.DISPLAY_OFFSET}, 'unixepoch')"
+
+    def local_date(self, column):
+        """SQL expression giving the local YYYY-MM-DD day of an epoch column"""
+        return f"date({column} + {self.DISPLAY_OFFSET}, 'unixepoch')"
+
+    def ensure_column(self, table, column, declaration):
+        """Add a column to an existing table created by an older version"""
+        columns = {row[1] for row in self.conn.execute(f'PRAGMA table_info({table})')}
+        if column not in columns:
+            self.conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {declaration}')
+
+    def iter_story_keys(self):
+        """Iterate over the (user_id, story_id) pairs already stored"""
+        self.flush()
+        return self.conn.execute('SELECT user_id, story_id FROM stories')
+
+    def fetch_known_keys(self, candidates):
+        """Return which of the given {user_id: story_ids} pairs are already stored"""
+        self.flush()
+        known = set()
+        for user_id, story_ids in candidates.items():
+            story_ids = list(story_ids)
+            for i in range(0, len(story_ids), 500):
+                chunk = story_ids[i:i + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self.conn.execute(
+                    f'SELECT story_id FROM stories WHERE user_id = ? AND story_id IN ({placeholders})',
+                    (user_id, *chunk)
+                )
+                known.update((user_id, story_id) for (story_id,) in rows)
+        return known
+
+    def count_stories(self):
+        """Return the number of stored stories"""
+        self.flush()
+        return self.conn.execute('SELECT total_stories FROM story_totals WHERE id = 1').fetchone()[0]
+
+    def iter_stories(self, chunk_size=5000):
+        """Yield stored stories newest first, in chunks of at most chunk_size rows"""
+        self.flush()
+        cursor = self.conn.execute(
+            f'SELECT user_id, story_id, {self.local_time("timestamp")}, filename FROM stories ORDER BY timestamp DESC'
+        )
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+
+    def fetch_last_rowid(self):
+        """Return the rowid of the most recently inserted story, 0 when there are none"""
+        self.flush()
+        return self.conn.execute('SELECT COALESCE(MAX(rowid), 0) FROM stories').fetchone()[0]
+
+    def count_stories_between(self, after, until):
+        """Return the number of stories with after < rowid <= until"""
+        return self.conn.execute(
+            'SELECT COUNT(*) FROM stories WHERE rowid > ? AND rowid <= ?', (after, until)
+        ).fetchone()[0]
+
+    def iter_stories_between(self, after, until, chunk_size=5000):
+        """Yield stories with after < rowid <= until in insertion order, in chunks"""
+        cursor = self.conn.execute(f'''
+        SELECT user_id, story_id, {self.local_time("timestamp")}, filename FROM stories
+        WHERE rowid > ? AND rowid <= ? ORDER BY rowid
+        ''', (after, until))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+
+    def fetch_column_widths(self):
+        """Return the longest text length of each exported column"""
+        self.flush()
+        return self.conn.execute('''
+        SELECT COALESCE(MAX(LENGTH(user_id)), 0), COALESCE(MAX(LENGTH(story_id)), 0),
+               CASE WHEN COUNT(*) THEN 19 ELSE 0 END, COALESCE(MAX(LENGTH(filename)), 0)
+        FROM stories
+        ''').fetchone()
+
+    def fetch_statistics(self):
+        """Return total stories, unique users, last story date and stories today"""
+        self.flush()
+        return self.conn.execute(f'''
+        SELECT total_stories, unique_users, {self.local_time('last_timestamp')},
+               (SELECT COALESCE(SUM(stories), 0) FROM daily_rollup
+                WHERE day = date('now', '+{self.DISPLAY_OFFSET} seconds'))
+        FROM story_totals
+        WHERE id = 1
+        ''').fetchone()
+
+    def fetch_day_partitions(self):
+        """Return {day: (row_count, checksum)} for every day that has stories"""
+        self.flush()
+        rows = self.conn.execute('''
+        SELECT day, SUM(stories), TOTAL(user_id * stories)
+        FROM daily_rollup
+        GROUP BY day
+        ''')
+        return {day: (count, int(checksum)) for day, count, checksum in rows}
+
+    def fetch_stories_for_day(self, day):
+        """Return the stories posted on a given local YYYY-MM-DD day, with epoch timestamps"""
+        self.flush()
+        start = int(datetime.strptime(day, '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp()) - self.DISPLAY_OFFSET
+        return self.conn.execute('''
+        SELECT user_id, story_id, timestamp, filename FROM stories
+        WHERE timestamp >= ? AND timestamp < ?
+        ORDER BY timestamp
+        ''', (start, start + 86400)).fetchall()
+
+    def fetch_exported_partitions(self, target):
+        """Return {partition: (row_count, checksum)} recorded for an export target"""
+        rows = self.conn.execute(
+            'SELECT partition, row_count, checksum FROM export_partitions WHERE target = ?', (target,)
+        )
+        return {partition: (count, checksum) for partition, count, checksum in rows}
+
+    def mark_partition_exported(self, target, partition, row_count, checksum):
+        """Record that a partition has been written for an export target"""
+        with self.conn:
+            self.conn.execute('''
+            INSERT OR REPLACE INTO export_partitions (target, partition, row_count, checksum)
+            VALUES (?, ?, ?, ?)
+            ''', (target, partition, row_count, checksum))
+
+    def query_stories(self, user_ids=None, since=None, until=None, media_type=None,
+                      min_size=None, max_size=None, limit=None):
+        """Return stories joined with their metadata, newest first, filtered on indexed columns"""
+        self.flush()
+        clauses, params = [], []
+        if user_ids:
+            clauses.append(f"s.user_id IN ({','.join('?' * len(user_ids))})")
+            params.extend(user_ids)
+        if since is not None:
+            clauses.append('s.timestamp >= ?')
+            params.append(since)
+        if until is not None:
+            clauses.append('s.timestamp < ?')
+            params.append(until)
+        if media_type:
+            clauses.append('m.media_type = ?')
+            params.append(media_type)
+        if min_size is not None:
+            clauses.append('m.size >= ?')
+            params.append(min_size)
+        if max_size is not None:
+            clauses.append('m.size <= ?')
+            params.append(max_size)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        if limit:
+            params.append(limit)
+        return self.conn.execute(f'''
+        SELECT s.user_id, s.story_id, {self.local_time('s.timestamp')}, s.filename, m.media_type, m.mime_type,
+               m.size, m.duration, m.views, {self.local_time('m.expires')}, m.caption, m.extra
+        FROM stories s
+        LEFT JOIN story_metadata m ON m.user_id = s.user_id AND m.story_id = s.story_id
+        {where}
+        ORDER BY s.timestamp DESC
+        {'LIMIT ?' if limit else ''}
+        ''', params).fetchall()
+
+    def get_export_cursor(self, target):
+        """Return (last_rowid, row_count, size) recorded for a cached export, or None"""
+        return self.conn.execute(
+            'SELECT last_rowid, row_count, size FROM export_cursors WHERE target = ?', (target,)
+        ).fetchone()
+
+    def set_export_cursor(self, target, last_rowid, row_count, size):
+        """Record how far a cached export has got and the size of the file it wrote"""
+        with self.conn:
+            self.conn.execute('''
+            INSERT OR REPLACE INTO export_cursors (target, last_rowid, row_count, size)
+            VALUES (?, ?, ?, ?)
+            ''', (target, last_rowid, row_count, size))
+
+    def record_account_peers(self, account, user_ids):
+        """Remember which peers an account can see stories from"""
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO account_peers (account, user_id) VALUES (?, ?)',
+                [(account, user_id) for user_id in user_ids]
+            )
+
+    def fetch_peer_accounts(self, user_ids):
+        """Return {user_id: set of accounts} that can see each of the given peers"""
+        accounts = defaultdict(set)
+        user_ids = list(user_ids)
+        for i in range(0, len(user_ids), 500):
+            chunk = user_ids[i:i + 500]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.conn.execute(
+                f'SELECT user_id, account FROM account_peers WHERE user_id IN ({placeholders})', chunk
+            )
+            for user_id, account in rows:
+                accounts[user_id].add(account)
+        return accounts
+
+    def get_partial_offset(self, part_file):
+        """Return the last verified offset of an interrupted download"""
+        row = self.conn.execute('SELECT offset FROM partial_downloads WHERE part_file = ?', (part_file,)).fetchone()
+        return row[0] if row else 0
+
+    def save_partial_offset(self, part_file, offset):
+        """Record how far an in-progress download has been written to disk"""
+        with self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO partial_downloads (part_file, offset) VALUES (?, ?)', (part_file, offset)
+            )
+
+    def clear_partial_offset(self, part_file):
+        """Forget a finished download's progress"""
+        with self.conn:
+            self.conn.execute('DELETE FROM partial_downloads WHERE part_file = ?', (part_file,))
+
+    def save_processing_result(self, filename, result):
+        """Record the outcome of post-download processing for a file"""
+        with self.conn:
+            self.conn.execute('''
+            INSERT OR REPLACE INTO media_processing (filename, status, thumbnail, phash, transcoded, error)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ''', (filename, 'failed' if result.get('error') else 'done', result.get('thumbnail'),
+                  result.get('phash'), result.get('transcoded'), result.get('error')))
+
+    def mark_processing_deferred(self, filename):
+        """Remember a file the processing queue had no room for"""
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO media_processing (filename, status) VALUES (?, 'deferred')", (filename,)
+            )
+
+    def claim_deferred_processing(self, limit, statuses=('deferred',)):
+        """Mark up to limit waiting files as queued and return them"""
+        placeholders = ','.join('?' * len(statuses))
+        filenames = [filename for (filename,) in self.conn.execute(
+            f'SELECT filename FROM media_processing WHERE status IN ({placeholders}) LIMIT ?', (*statuses, limit)
+        )]
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE media_processing SET status = 'queued' WHERE filename = ?", [(f,) for f in filenames]
+            )
+        return filenames
+
+    def record_missed_stories(self, rows):
+        """Remember (user_id, story_id, expires) stories a cycle deferred or failed to download"""
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO missed_stories (user_id, story_id, expires) VALUES (?, ?, ?)', rows
+            )
+
+    def clear_missed_stories(self, keys):
+        """Forget missed stories that were since stored or counted as expired"""
+        with self.conn:
+            self.conn.executemany('DELETE FROM missed_stories WHERE user_id = ? AND story_id = ?', keys)
+
+    def expire_missed_stories(self, now):
+        """Return how many missed stories expired without being stored, and forget settled ones"""
+        rows = self.conn.execute('''
+        SELECT m.user_id, m.story_id, m.expires <= ?, s.story_id IS NOT NULL
+        FROM missed_stories m
+        LEFT JOIN stories s ON s.user_id = m.user_id AND s.story_id = m.story_id
+        ''', (now,)).fetchall()
+        expired = sum(1 for _, _, past, stored in rows if past and not stored)
+        self.clear_missed_stories([(user_id, story_id) for user_id, story_id, past, stored in rows
+                                   if past or stored])
+        return expired
+
+    def get_sync_state(self, name):
+        """Return a saved sync token, or None"""
+        row = self.conn.execute('SELECT value FROM sync_state WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_sync_state(self, name, value):
+        """Save a sync token"""
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO sync_state (name, value) VALUES (?, ?)', (name, value))
+
+    def fetch_media_path(self, media_key):
+        """Return the stored object path for a Telegram media key, or None"""
+        row = self.conn.execute('SELECT path FROM media WHERE media_key = ?', (media_key,)).fetchone()
+        return row[0] if row else None
+
+    def fetch_media_by_hash(self, sha256):
+        """Return the stored object path with the given content hash, or None"""
+        row = self.conn.execute('SELECT path FROM media WHERE sha256 = ? LIMIT 1', (sha256,)).fetchone()
+        return row[0] if row else None
+
+    def add_media(self, media_key, path, sha256, size):
+        """Record a stored media object"""
+        with self.conn:
+            self.conn.execute('''
+            INSERT OR REPLACE INTO media (media_key, path, sha256, size)
+            VALUES (?, ?, ?, ?)
+            ''', (media_key, path, sha256, size))
+
+    def add_story(self, user_id, story_id, timestamp, filename, media_key=None):
+        """Buffer a story row and flush when the batch is full or stale"""
+        self.pending.append((user_id, story_id, timestamp, filename, media_key))
+        if len(self.pending) >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def add_story_metadata(self, row):
+        """Buffer a story_metadata row to be written with the next story batch
+
+        row is (user_id, story_id, media_type, mime_type, size, duration, views,
+        expires, caption, extra) with extra a JSON object of rarely used fields.
+        """
+        self.pending_metadata.append(row)
+
+    def flush(self):
+        """Write buffered rows in a single transaction"""
+        self.last_flush = time.monotonic()
+        if not self.pending and not self.pending_metadata:
+            return
+        rows, self.pending = self.pending, []
+        metadata, self.pending_metadata = self.pending_metadata, []
+        started = time.perf_counter()
+        with self.conn:
+            self.conn.executemany('''
+            INSERT OR IGNORE INTO stories (user_id, story_id, timestamp, filename, media_key)
+            VALUES (?, ?, ?, ?, ?)
+            ''', rows)
+            self.conn.executemany('''
+            INSERT OR REPLACE INTO story_metadata
+                (user_id, story_id, media_type, mime_type, size, duration, views, expires, caption, extra)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', metadata)
+        if self.metrics:
+            self.metrics.observe('db_write', time.perf_counter() - started)
+            self.metrics.inc('db_rows_written', len(rows))
+
+    def close(self):
+        """Flush pending rows and close the connection"""
+        self.flush()
+        self.conn.close()
+
+class StoryIndex:
+    """Compact in-memory index of stored (user_id, story_id) pairs"""
+
+    STORY_BITS = 24
+    USER_BITS = 40
+    COMPACT_THRESHOLD = 4096
+
+    def __init__(self):
+        self.keys = array('Q')
+        self.recent = set()
+        self.overflow = set()
+
+    @classmethod
+    def pack(cls, user_id, story_id):
+        """Pack a pair into a 64-bit key, or None if it does not fit"""
+        if 0 <= story_id < (1 << cls.STORY_BITS) and 0 <= user_id < (1 << cls.USER_BITS):
+            return (user_id << cls.STORY_BITS) | story_id
+        return None
+
+    def load(self, pairs):
+        """Build the index from an iterable of stored pairs"""
+        keys = []
+        self.recent.clear()
+        self.overflow.clear()
+        for user_id, story_id in pairs:
+            key = self.pack(user_id, story_id)
+            if key is None:
+                self.overflow.add((user_id, story_id))
+            else:
+                keys.append(key)
+        keys.sort()
+        self.keys = array('Q', keys)
+        return self
+
+    def add(self, user_id, story_id):
+        """Record a newly stored pair"""
+        key = self.pack(user_id, story_id)
+        if key is None:
+            self.overflow.add((user_id, story_id))
+            return
+        self.recent.add(key)
+        if len(self.recent) >= self.COMPACT_THRESHOLD:
+            self.compact()
+
+    def compact(self):
+        """Merge recently added keys into the sorted array"""
+        if self.recent:
+            self.keys = array('Q', sorted(itertools.chain(self.keys, self.recent)))
+            self.recent.clear()
+
+    def __contains__(self, pair):
+        key = self.pack(*pair)
+        if key is None:
+            return pair in self.overflow
+        if key in self.recent:
+            return True
+        i = bisect.bisect_left(self.keys, key)
+        return i < len(self.keys) and self.keys[i] == key
+
+    def __len__(self):
+        return len(self.keys) + len(self.recent) + len(self.overflow)
+
+    def memory_usage(self):
+        """Approximate bytes held by the index, counting the objects inside its sets"""
+        return (self.keys.buffer_info()[1] * self.keys.itemsize
+                + sys.getsizeof(self.recent) + sum(sys.getsizeof(key) for key in self.recent)
+                + sys.getsizeof(self.overflow)
+                + sum(sys.getsizeof(pair) + sys.getsizeof(pair[0]) + sys.getsizeof(pair[1])
+                      for pair in self.overflow))
+
+    @staticmethod
+    def estimate_memory(count):
+        """Approximate bytes an index of count stored pairs takes once loaded and compacted"""
+        return count * array('Q').itemsize
+
+class ScheduledJob:
+    """A coroutine function run by AsyncScheduler on a fixed interval"""
+
+    def __init__(self, name, interval, func, jitter=0.0, run_immediately=True):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.jitter = jitter
+        self.run_immediately = run_immediately
+        self.task = None
+        self.runs = 0
+        self.skipped = 0
+
+class AsyncScheduler:
+    """Interval scheduler running every job as a task in one event loop"""
+
+    def __init__(self):
+        self.jobs = []
+        self.stop_event = asyncio.Event()
+
+    def every(self, interval, func, name=None, jitter=0.0, run_immediately=True):
+        """Register a coroutine function to run every interval seconds"""
+        job = ScheduledJob(name or func.__name__, interval, func, jitter, run_immediately)
+        self.jobs.append(job)
+        return job
+
+    def stop(self):
+        """Stop scheduling new runs"""
+        self.stop_event.set()
+
+    async def invoke(self, job):
+        """Run a job once, reporting rather than raising errors"""
+        try:
+            job.runs += 1
+            await job.func()
+        except Exception as e:
+            console.print(f"[red]Job {job.name} failed: {str(e)}[/red]")
+
+    async def run_job(self, job):
+        """Fire a job on its interval grid until the scheduler stops"""
+        loop = asyncio.get_running_loop()
+        next_run = loop.time() if job.run_immediately else loop.time() + job.interval
+        while not self.stop_event.is_set():
+            delay = next_run - loop.time()
+            if job.jitter:
+                delay += random.uniform(0, job.jitter)
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self.stop_event.wait(), delay)
+                    break
+                except asyncio.TimeoutError:
+                    pass
+
+            if job.task and not job.task.done():
+                job.skipped += 1
+                console.print(f"[yellow]Skipping {job.name}: previous run still in progress[/yellow]")
+            else:
+                job.task = asyncio.create_task(self.invoke(job))
+
+            # Ticks stay on a fixed grid so slow runs do not make the schedule drift
+            next_run += job.interval
+            now = loop.time()
+            if next_run < now:
+                next_run += ((now - next_run) // job.interval + 1) * job.interval
+
+    async def run(self, drain_timeout=None):
+        """Run all jobs until stop() is called, then wait for in-flight runs"""
+        timers = [asyncio.create_task(self.run_job(job)) for job in self.jobs]
+        await self.stop_event.wait()
+        await asyncio.gather(*timers, return_exceptions=True)
+
+        running = [job.task for job in self.jobs if job.task and not job.task.done()]
+        if running:
+            console.print(f"[cyan]Waiting for {len(running)} running job(s) to finish...[/cyan]")
+            done, pending = await asyncio.wait(running, timeout=drain_timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
 class StoryScraper:
     def __init__(self):
         self.db_file = 'stories.db'
@@ -52,26 +1143,64 @@ class StoryScraper:
         self.csv_file_path = 'stories_info.csv'
         self.credentials_file = 'credentials.json'
         self.credentials = None
+        self.session_name = 'session_name'
+        self.client_factory = None
         self.client = None
-        self.console = Console()
+        self.console = console
+        self.max_concurrent_downloads = 5
+        self.max_downloads_per_peer = 2
+        self.max_download_retries = 3
+        self.flood_backoff = 1
+        self.flood_wait_until = 0
+        self.download_chunk_size = 512 * 1024
+        self.checkpoint_bytes = 4 * 1024 * 1024
+        self.transfer = {'bytes': 0, 'reserved': 0, 'resumed': 0, 'started': time.monotonic()}
+        self.peer_priorities = {}
+        self.cycle_byte_budget = None
+        self.dedupe_mode = 'index'
+        self.story_index = None
+        self.incremental_sync = True
+        self.sync_state_name = 'all_stories'
+        self.content_addressed = False
+        self.media_dir = 'stories/objects'
+        self.media_locks = defaultdict(asyncio.Lock)
+        self.headless = False
+        self.interactive = True
+        self.stopping = False
+        self.metrics = Metrics()
+        self.metrics_log = None
+        self.profile_dir = None
+        self.processor = None
+        self.output = OutputRenderer()
+        self.refresh_per_second = 2
         self.initialize_database()
+        self.db.metrics = self.metrics
 
     async def initialize_client(self):
         """Initialize and authenticate the Telegram client"""
         try:
             if not self.client:
                 console.print("[cyan]Initializing Telegram client...[/cyan]")
-                self.credentials = self.load_credentials()
+                load_telethon()
+                if not self.credentials and not self.interactive and not os.path.exists(self.credentials_file):
+                    console.print(f"[red]No credentials found in {self.credentials_file}; run TGSS.py once interactively to set them up[/red]")
+                    return False
+                self.credentials = self.credentials or self.load_credentials()
                 
-                self.client = TelegramClient('session_name', 
-                                           self.credentials['api_id'], 
-                                           self.credentials['api_hash'])
+                client_factory = self.client_factory or TelegramClient
+                self.client = client_factory(self.session_name, 
+                                                  self.credentials['api_id'], 
+                                                  self.credentials['api_hash'])
                 
                 await self.client.connect()
                 
                 if not await self.client.is_user_authorized():
+                    if not self.interactive:
+                        console.print(f"[red]Session '{self.session_name}' is not authorized; run TGSS.py once interactively to log in[/red]")
+                        return False
                     console.print("[yellow]Requesting authentication code...[/yellow]")
                     await self.client.send_code_request(self.credentials['phone_number'])
+                    from rich.prompt import Prompt
                     code = Prompt.ask("[cyan]Enter the code you received on Telegram")
                     try:
                         await self.client.sign_in(self.credentials['phone_number'], code)
@@ -81,7 +1210,7 @@ class StoryScraper:
                         return False
                 
                 console.print("[green]✓[/green] Client initialized and authenticated!")
-                return True
+            return True
                 
         except Exception as e:
             console.print(f"[red]Error during client initialization: {str(e)}[/red]")
@@ -97,6 +1226,8 @@ class StoryScraper:
 
     def prompt_for_credentials(self):
         """Prompt user for Telegram API credentials"""
+        from rich.panel import Panel
+        from rich.prompt import Prompt
         console.print(Panel("[yellow]Please enter your Telegram API credentials[/yellow]"))
         credentials = {
             'api_id': Prompt.ask("Enter your API ID"),
@@ -109,199 +1240,534 @@ class StoryScraper:
         
         return credentials
 
+    def make_progress(self):
+        """Return a rich progress display, or a no-op one when headless"""
+        if self.headless:
+            return NullProgress()
+        from rich.progress import Progress, SpinnerColumn, TextColumn, BarColumn, TaskProgressColumn
+        return Progress(
+            SpinnerColumn(),
+            TextColumn("[progress.description]{task.description}"),
+            BarColumn(),
+            TaskProgressColumn(),
+            console=console._get(),
+            refresh_per_second=self.refresh_per_second
+        )
+
     def initialize_database(self):
         """Initialize SQLite database"""
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS stories (
-            user_id INTEGER,
-            story_id INTEGER PRIMARY KEY,
-            timestamp TEXT,
-            filename TEXT
+        self.db = StoryDatabase(self.db_file)
+
+    def fetch_stories_from_db(self, peer_stories):
+        """Return the stored stories to dedupe the current response against"""
+        if self.dedupe_mode == 'lookup':
+            candidates = {
+                peer_story.peer.user_id: [story.id for story in peer_story.stories]
+                for peer_story in peer_stories
+            }
+            return self.db.fetch_known_keys(candidates)
+
+        if self.story_index is None:
+            self.story_index = StoryIndex().load(self.db.iter_story_keys())
+        return self.story_index
+
+    def insert_story(self, user_id, story_id, timestamp, filename, media_key=None):
+        """Queue a new story for the next batched database write"""
+        self.db.add_story(user_id, story_id, timestamp, filename, media_key)
+        if self.story_index is not None:
+            self.story_index.add(user_id, story_id)
+
+    def story_expiry(self, story):
+        """Return when a story expires, assuming the usual 24 hours if Telegram did not say"""
+        expire_date = getattr(story, 'expire_date', None)
+        return expire_date or story.date + timedelta(hours=24)
+
+    def download_priority(self, user_id, story, now):
+        """Lower is sooner: seconds until expiry divided by the peer's priority weight"""
+        remaining = max((self.story_expiry(story) - now).total_seconds(), 0)
+        return remaining / max(self.peer_priorities.get(user_id, 1.0), 1e-6)
+
+    def build_download_queue(self, peer_stories, existing_stories):
+        """Queue new stories by expiry and peer priority and count the ones already stored"""
+        per_peer = []
+        skipped = 0
+        for peer_story in peer_stories:
+            user_id = peer_story.peer.user_id
+            pending = []
+            for story in peer_story.stories:
+                if (user_id, story.id) in existing_stories:
+                    skipped += 1
+                else:
+                    pending.append((user_id, story))
+            per_peer.append(pending)
+
+        # Equal priorities fall back to interleaving peers round-robin
+        now = datetime.now(timezone.utc)
+        queue = asyncio.PriorityQueue()
+        order = 0
+        for round_items in itertools.zip_longest(*per_peer):
+            for item in round_items:
+                if item is not None:
+                    user_id, story = item
+                    queue.put_nowait((self.download_priority(user_id, story, now), order, user_id, story))
+                    order += 1
+        return queue, skipped
+
+    def estimated_size(self, story):
+        """Return the media size in bytes when Telegram reports it, else 0"""
+        document = getattr(story.media, 'document', None)
+        return getattr(document, 'size', None) or 0
+
+    def story_metadata(self, user_id, story):
+        """Build the story_metadata row from the fields Telegram sent with a story"""
+        extra = {}
+        duration = None
+        document = getattr(story.media, 'document', None)
+        if document is not None:
+            mime_type = document.mime_type
+            media_type = mime_type.split('/')[0]
+            size = document.size
+            for attribute in document.attributes:
+                duration = getattr(attribute, 'duration', None) or duration
+                if getattr(attribute, 'w', None):
+                    extra['width'], extra['height'] = attribute.w, attribute.h
+                if getattr(attribute, 'file_name', None):
+                    extra['file_name'] = attribute.file_name
+        else:
+            mime_type, media_type, size = 'image/jpeg', 'photo', None
+            sizes = getattr(getattr(story.media, 'photo', None), 'sizes', None) or []
+            # Progressive sizes list the byte count of each quality step; the largest is the full file
+            largest = max(sizes, key=lambda s: getattr(s, 'size', None) or max(getattr(s, 'sizes', None) or [0]),
+                          default=None)
+            if largest is not None:
+                size = getattr(largest, 'size', None) or max(getattr(largest, 'sizes', None) or [0]) or None
+                if getattr(largest, 'w', None):
+                    extra['width'], extra['height'] = largest.w, largest.h
+
+        views = getattr(story, 'views', None)
+        if views is not None:
+            if views.forwards_count:
+                extra['forwards'] = views.forwards_count
+            if views.reactions_count:
+                extra['reactions'] = views.reactions_count
+        for flag in ('pinned', 'public', 'close_friends', 'contacts', 'selected_contacts', 'noforwards', 'edited'):
+            if getattr(story, flag, None):
+                extra[flag] = True
+
+        return (
+            user_id, story.id, media_type, mime_type, size, duration,
+            views.views_count if views is not None else None,
+            int(self.story_expiry(story).timestamp()),
+            getattr(story, 'caption', None) or None,
+            json.dumps(extra, separators=(',', ':')) if extra else None,
         )
-        ''')
-        conn.commit()
-        conn.close()
-
-    def fetch_stories_from_db(self):
-        """Fetch existing stories from database"""
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        cursor.execute('SELECT user_id, story_id FROM stories')
-        stories = cursor.fetchall()
-        conn.close()
-        return set(stories)
-
-    def insert_story(self, user_id, story_id, timestamp, filename):
-        """Insert a new story into database"""
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        cursor.execute('''
-        INSERT OR IGNORE INTO stories (user_id, story_id, timestamp, filename)
-        VALUES (?, ?, ?, ?)
-        ''', (user_id, story_id, timestamp, filename))
-        conn.commit()
-        conn.close()
+
+    def media_identity(self, media):
+        """Return the media key, downloadable object and file extension of a story's media"""
+        if isinstance(media, MessageMediaPhoto):
+            return f"photo:{media.photo.id}:{media.photo.access_hash}", media.photo, 'jpg'
+        if isinstance(media, MessageMediaDocument):
+            document = media.document
+            return f"document:{document.id}:{document.access_hash}", document, document.mime_type.split('/')[1]
+        return None, None, None
+
+    async def download_document(self, document, path):
+        """Download a document in ranged chunks into a .part file, resuming earlier attempts"""
+        part_file = f"{path}.part"
+        offset = self.db.get_partial_offset(part_file) if os.path.exists(part_file) else 0
+        if offset:
+            on_disk = os.path.getsize(part_file)
+            offset = min(offset, on_disk - on_disk % self.download_chunk_size)
+            self.transfer['resumed'] += 1
+            self.metrics.inc('downloads_resumed')
+
+        with open(part_file, 'r+b' if offset else 'wb') as f:
+            f.seek(offset)
+            f.truncate()
+            unsaved = 0
+            async for chunk in self.client.iter_download(document, offset=offset,
+                                                         request_size=self.download_chunk_size,
+                                                         file_size=document.size):
+                f.write(chunk)
+                offset += len(chunk)
+                unsaved += len(chunk)
+                self.transfer['bytes'] += len(chunk)
+                self.metrics.inc('bytes_downloaded', len(chunk))
+                if unsaved >= self.checkpoint_bytes:
+                    f.flush()
+                    os.fsync(f.fileno())
+                    self.db.save_partial_offset(part_file, offset)
+                    unsaved = 0
+
+        if document.size and offset < document.size:
+            self.db.save_partial_offset(part_file, offset)
+            raise IOError(f"download stopped at {offset} of {document.size} bytes")
+
+        os.replace(part_file, path)
+        self.db.clear_partial_offset(part_file)
+
+    async def fetch_media(self, target, path):
+        """Download a photo or document to path"""
+        if isinstance(target, Document):
+            await self.download_document(target, path)
+        else:
+            await self.client.download_media(target, file=path)
+            size = os.path.getsize(path)
+            self.transfer['bytes'] += size
+            self.metrics.inc('bytes_downloaded', size)
+
+    def transfer_summary(self):
+        """Describe this cycle's download volume, rate and resumed files"""
+        elapsed = max(time.monotonic() - self.transfer['started'], 1e-6)
+        megabytes = self.transfer['bytes'] / (1024 * 1024)
+        return f"{megabytes:.1f} MB, {megabytes / elapsed:.2f} MB/s, {self.transfer['resumed']} resumed"
+
+    async def download_story(self, user_id, story):
+        """Download the media of a single story and return its filename and media key"""
+        media_key, target, ext = self.media_identity(story.media)
+        if target is None:
+            return None, None
+
+        filename = f"stories/{user_id}_{story.id}.{ext}"
+        if not self.content_addressed:
+            await self.fetch_media(target, filename)
+            return filename, media_key
+
+        async with self.media_locks[media_key]:
+            stored = self.db.fetch_media_path(media_key)
+            if stored and os.path.exists(stored):
+                link_file(stored, filename)
+                return filename, media_key
+
+            temp_file = f"{filename}.tmp"
+            await self.fetch_media(target, temp_file)
+            digest, size = await asyncio.to_thread(hash_file, temp_file)
+
+            object_path = self.db.fetch_media_by_hash(digest)
+            if object_path and os.path.exists(object_path):
+                os.remove(temp_file)
+            else:
+                object_path = os.path.join(self.media_dir, digest[:2], f"{digest}.{ext}")
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                os.replace(temp_file, object_path)
+
+            link_file(object_path, filename)
+            self.db.add_media(media_key, object_path, digest, size)
+
+        return filename, media_key
+
+    async def download_with_backoff(self, user_id, story):
+        """Download a story, pausing every worker while Telegram asks us to wait"""
+        for attempt in range(self.max_download_retries + 1):
+            delay = self.flood_wait_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                result = await self.download_story(user_id, story)
+                self.flood_backoff = 1
+                return result
+            except FloodWaitError as e:
+                if attempt == self.max_download_retries:
+                    raise
+                wait = e.seconds + self.flood_backoff
+                self.flood_backoff = min(self.flood_backoff * 2, 60)
+                self.flood_wait_until = max(self.flood_wait_until, time.monotonic() + wait)
+                self.metrics.inc('flood_waits')
+                self.metrics.inc('flood_wait_seconds', wait)
+                self.output.note(f"[yellow]Flood wait for story {story.id}, pausing downloads for {wait}s[/yellow]")
+
+    async def download_worker(self, queue, peer_limits, progress, download_task, results):
+        """Take stories off the queue until it is empty"""
+        while not self.stopping:
+            try:
+                item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            _, _, user_id, story = item
+
+            # Downloads still in flight count at their full size, otherwise every
+            # worker would pass the check before any of their bytes arrived.
+            size = self.estimated_size(story)
+            committed = self.transfer['bytes'] + self.transfer['reserved'] + size
+            over_budget = self.cycle_byte_budget and committed > self.cycle_byte_budget
+            if over_budget and results['started']:
+                # Over this cycle's budget: leave the rest for the next cycle. The first
+                # download of a cycle always goes ahead, so a story bigger than the
+                # whole budget cannot hold up every later cycle.
+                queue.put_nowait(item)
+                queue.task_done()
+                return
+            self.metrics.set('queue_depth', queue.qsize())
+
+            if self.story_expiry(story) <= datetime.now(timezone.utc):
+                results['missed'].append((user_id, story))
+                progress.advance(download_task)
+                queue.task_done()
+                continue
+
+            results['started'] += 1
+            self.transfer['reserved'] += size
+            timestamp = int(story.date.timestamp())
+
+            try:
+                async with peer_limits[user_id]:
+                    with self.metrics.timer('download'):
+                        filename, media_key = await self.download_with_backoff(user_id, story)
+
+                if filename:
+                    self.insert_story(user_id, story.id, timestamp, filename, media_key)
+                    self.db.add_story_metadata(self.story_metadata(user_id, story))
+                    results['new'] += 1
+                    self.metrics.inc('stories_downloaded')
+                    if self.processor:
+                        self.processor.submit(filename)
+                    self.output.downloaded(filename)
+
+            except Exception as e:
+                self.output.error(f"Error downloading story {story.id}: {str(e)}")
+                results['failed'] += 1
+                results['missed'].append((user_id, story))
+                self.metrics.inc('download_errors')
+            finally:
+                self.transfer['reserved'] -= size
+                progress.update(download_task, advance=1,
+                                description=f"[cyan]Downloading media... ({self.transfer_summary()})")
+                queue.task_done()
+
+    async def fetch_peer_stories(self):
+        """Fetch active peer stories, following pagination; returns (peer_stories, state)
+
+        With incremental sync the saved state is sent back so the server can
+        answer with AllStoriesNotModified, in which case peer_stories is None.
+        """
+        state = self.db.get_sync_state(self.sync_state_name) if self.incremental_sync else None
+        result = await self.client(GetAllStoriesRequest(state=state))
+        if isinstance(result, AllStoriesNotModified):
+            return None, result.state
+
+        peer_stories = list(result.peer_stories)
+        while result.has_more:
+            result = await self.client(GetAllStoriesRequest(next=True, state=result.state))
+            if isinstance(result, AllStoriesNotModified):
+                break
+            peer_stories.extend(result.peer_stories)
+        return peer_stories, result.state
+
+    async def select_peer_stories(self, peer_stories):
+        """Return the peer stories this scraper is responsible for"""
+        return peer_stories
+
     async def scrape_stories(self):
-        """Scrape stories from Telegram"""
+        """Scrape stories from Telegram, recording metrics and an optional profile"""
+        self.metrics.start_cycle()
+        self.output.start()
+        profiler = None
+        if self.profile_dir:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        started = time.perf_counter()
+        try:
+            return await self.scrape_cycle()
+        finally:
+            self.metrics.observe('cycle', time.perf_counter() - started)
+            self.metrics.inc('cycles')
+            if profiler:
+                profiler.disable()
+                os.makedirs(self.profile_dir, exist_ok=True)
+                stamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+                profiler.dump_stats(os.path.join(self.profile_dir, f"cycle_{stamp}.prof"))
+            if self.metrics_log:
+                self.write_metrics_log()
+
+    def write_metrics_log(self):
+        """Append this cycle's metrics to the JSON lines log"""
+        record = {'time': datetime.now().isoformat(timespec='seconds')}
+        record.update(self.metrics.cycle_record())
+        with open(self.metrics_log, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + "\n")
+
+    async def scrape_cycle(self):
+        """Run one scrape cycle"""
+        load_telethon()
         if not self.client:
             success = await self.initialize_client()
             if not success:
-                return
+                return False
         
-        with Progress(
-            SpinnerColumn(),
-            TextColumn("[progress.description]{task.description}"),
-            BarColumn(),
-            TaskProgressColumn(),
-            console=console
-        ) as progress:
+        with self.make_progress() as progress:
             main_task = progress.add_task("[cyan]Scanning for stories...", total=None)
             
             try:
-                all_stories = await self.client(GetAllStoriesRequest())
+                with self.metrics.timer('api_call'):
+                    peer_stories, state = await self.fetch_peer_stories()
 
-                if not all_stories or not all_stories.peer_stories:
-                    console.print("[yellow]No stories found.[/yellow]")
-                    return
+                if peer_stories is None:
+                    self.db.set_sync_state(self.sync_state_name, state)
+                    progress.update(main_task, completed=True)
+                    self.output.note("[yellow]No story changes since last check[/yellow]")
+                    return True
 
-                existing_stories = self.fetch_stories_from_db()
-                new_stories_count = 0
-                total_stories = sum(len(peer_story.stories) for peer_story in all_stories.peer_stories)
+                peer_stories = await self.select_peer_stories(peer_stories)
+                if not peer_stories:
+                    self.db.set_sync_state(self.sync_state_name, state)
+                    self.output.note("[yellow]No stories found.[/yellow]")
+                    return True
+
+                with self.metrics.timer('dedupe'):
+                    existing_stories = self.fetch_stories_from_db(peer_stories)
+                    queue, skipped = self.build_download_queue(peer_stories, existing_stories)
+                total_stories = sum(len(peer_story.stories) for peer_story in peer_stories)
+                self.metrics.set('queue_depth', queue.qsize())
                 
                 download_task = progress.add_task("[cyan]Downloading media...", total=total_stories)
+                self.transfer = {'bytes': 0, 'reserved': 0, 'resumed': 0, 'started': time.monotonic()}
+                # Fresh per cycle: a cycle may run on a new event loop, and the
+                # locks of finished downloads are not needed again.
+                self.media_locks = defaultdict(asyncio.Lock)
+                progress.advance(download_task, skipped)
 
-                for peer_story in all_stories.peer_stories:
-                    user_id = peer_story.peer.user_id
-                    
-                    for story in peer_story.stories:
-                        story_id = story.id
-                        if (user_id, story_id) in existing_stories:
-                            progress.advance(download_task)
-                            continue
-
-                        timestamp_utc = story.date
-                        timestamp_local = timestamp_utc + timedelta(hours=2)
-                        timestamp = timestamp_local.strftime('%Y-%m-%d %H:%M:%S')
-                        
-                        try:
-                            media = story.media
-                            filename = None
-
-                            if isinstance(media, MessageMediaPhoto):
-                                filename = f"stories/{user_id}_{story_id}.jpg"
-                                await self.client.download_media(media.photo, file=filename)
-                            elif isinstance(media, MessageMediaDocument):
-                                ext = media.document.mime_type.split('/')[1]
-                                filename = f"stories/{user_id}_{story_id}.{ext}"
-                                await self.client.download_media(media.document, file=filename)
-
-                            if filename:
-                                self.insert_story(user_id, story_id, timestamp, filename)
-                                new_stories_count += 1
-                                console.print(f"[green]Downloaded:[/green] {filename}")
-                                
-                        except Exception as e:
-                            console.print(f"[red]Error downloading story {story_id}: {str(e)}[/red]")
-
-                        progress.advance(download_task)
+                peer_limits = defaultdict(lambda: asyncio.Semaphore(self.max_downloads_per_peer))
+                results = {'new': 0, 'failed': 0, 'started': 0, 'missed': []}
+                workers = [
+                    asyncio.create_task(self.download_worker(queue, peer_limits, progress, download_task, results))
+                    for _ in range(min(self.max_concurrent_downloads, queue.qsize()))
+                ]
+                await asyncio.gather(*workers)
+                self.db.flush()
+                new_stories_count = results['new']
+
+                # Deferred and failed stories are remembered with their expiry, so
+                # the ones that run out before a later cycle stores them still count
+                # as expired.
+                leftover = [queue.get_nowait() for _ in range(queue.qsize())]
+                results['missed'].extend((user_id, story) for _, _, user_id, story in leftover)
+                self.db.record_missed_stories([
+                    (user_id, story.id, int(self.story_expiry(story).timestamp()))
+                    for user_id, story in results['missed']
+                ])
+                expired = self.db.expire_missed_stories(int(time.time()))
+                self.metrics.inc('stories_expired', expired)
+
+                # Only advance the sync state once everything in it has been stored,
+                # otherwise failed stories would never be offered again.
+                if not results['failed'] and not leftover:
+                    self.db.set_sync_state(self.sync_state_name, state)
 
                 progress.update(main_task, completed=True)
                 if new_stories_count > 0:
-                    console.print(f"[green]✓[/green] Downloaded {new_stories_count} new stories!")
+                    self.output.note(f"[green]✓[/green] Downloaded {new_stories_count} new stories! ({self.transfer_summary()})")
                 else:
-                    console.print("[yellow]No new stories to download[/yellow]")
+                    self.output.note("[yellow]No new stories to download[/yellow]")
+                if expired:
+                    self.output.note(f"[yellow]{expired} stories expired before they could be downloaded[/yellow]")
+                if leftover and not self.stopping:
+                    self.output.note(f"[yellow]Cycle bandwidth budget reached, {len(leftover)} stories left for the next cycle[/yellow]")
 
             except Exception as e:
-                console.print(f"[red]Error during scraping: {str(e)}[/red]")
+                self.output.error(f"Error during scraping: {str(e)}")
+                self.metrics.inc('cycle_errors')
                 return False
 
             return True
 
+    def report_export(self, path, rows, started):
+        """Print how long an export took and the process peak memory"""
+        elapsed = time.perf_counter() - started
+        if resource is not None:
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            peak_mb = peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+            memory = f"peak RSS {peak_mb:.1f} MB"
+        else:
+            memory = "peak RSS n/a"
+        console.print(f"[green]✓[/green] Successfully exported {rows} stories to {path}!")
+        console.print(f"[cyan]Export took {elapsed:.2f}s, {memory}[/cyan]")
+
+    def write_workbook(self, path, chunks, widths, progress, task):
+        """Write story chunks to a styled write-only workbook"""
+        import openpyxl
+        from openpyxl.cell import WriteOnlyCell
+
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet("Stories")
+
+        headers = ["User ID", "Story ID", "Timestamp", "Filename"]
+        # Write-only sheets emit column widths before any row, so size
+        # them from the data up front instead of walking the sheet after.
+        for col, (header, width) in enumerate(zip(headers, widths), 1):
+            letter = openpyxl.utils.get_column_letter(col)
+            ws.column_dimensions[letter].width = max(len(header), width) + 2
+
+        header_font = openpyxl.styles.Font(color="FFFFFF", bold=True)
+        header_fill = openpyxl.styles.PatternFill(start_color="1F4E79", end_color="1F4E79", fill_type="solid")
+        stripe_fill = openpyxl.styles.PatternFill(start_color="F2F2F2", end_color="F2F2F2", fill_type="solid")
+
+        header_row = []
+        for header in headers:
+            cell = WriteOnlyCell(ws, value=header)
+            cell.font = header_font
+            cell.fill = header_fill
+            header_row.append(cell)
+        ws.append(header_row)
+
+        row = 2
+        for chunk in chunks:
+            for story in chunk:
+                if row % 2:
+                    striped = []
+                    for value in story:
+                        cell = WriteOnlyCell(ws, value=value)
+                        cell.fill = stripe_fill
+                        striped.append(cell)
+                    ws.append(striped)
+                else:
+                    ws.append(story)
+                row += 1
+            progress.advance(task, len(chunk))
+
+        wb.save(path)
+
     def export_to_excel(self):
         """Export stories to Excel file"""
-        with Progress(
-            SpinnerColumn(),
-            TextColumn("[progress.description]{task.description}"),
-            BarColumn(),
-            TaskProgressColumn(),
-            console=console
-        ) as progress:
+        with self.make_progress() as progress:
             task = progress.add_task("[cyan]Preparing Excel export...", total=None)
             
             try:
-                conn = sqlite3.connect(self.db_file)
-                cursor = conn.cursor()
-                cursor.execute('SELECT * FROM stories ORDER BY timestamp DESC')
-                stories = cursor.fetchall()
-                conn.close()
+                started = time.perf_counter()
+                total = self.db.count_stories()
 
-                if not stories:
+                if not total:
                     console.print("[yellow]No stories to export[/yellow]")
-                    return
+                    return True
 
-                wb = openpyxl.Workbook()
-                ws = wb.active
-                ws.title = "Stories"
-                
-                headers = ["User ID", "Story ID", "Timestamp", "Filename"]
-                for col, header in enumerate(headers, 1):
-                    cell = ws.cell(row=1, column=col)
-                    cell.value = header
-                    cell.font = openpyxl.styles.Font(bold=True)
-                    cell.fill = openpyxl.styles.PatternFill(start_color="1F4E79", end_color="1F4E79", fill_type="solid")
-                    cell.font = openpyxl.styles.Font(color="FFFFFF", bold=True)
-
-                for row, story in enumerate(stories, 2):
-                    for col, value in enumerate(story, 1):
-                        cell = ws.cell(row=row, column=col)
-                        cell.value = value
-                        if row % 2:
-                            cell.fill = openpyxl.styles.PatternFill(start_color="F2F2F2", end_color="F2F2F2", fill_type="solid")
-
-                for column in ws.columns:
-                    max_length = 0
-                    column = list(column)
-                    for cell in column:
-                        try:
-                            if len(str(cell.value)) > max_length:
-                                max_length = len(str(cell.value))
-                        except:
-                            pass
-                    adjusted_width = (max_length + 2)
-                    ws.column_dimensions[column[0].column_letter].width = adjusted_width
+                progress.update(task, total=total)
 
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
                 excel_file = f"stories_export_{timestamp}.xlsx"
-                wb.save(excel_file)
-                progress.update(task, completed=True)
-                console.print(f"[green]✓[/green] Successfully exported to {excel_file}!")
+                self.write_workbook(excel_file, self.db.iter_stories(), self.db.fetch_column_widths(),
+                                    progress, task)
+                progress.update(task, completed=total)
+                self.report_export(excel_file, total, started)
 
             except Exception as e:
                 console.print(f"[red]Error during Excel export: {str(e)}[/red]")
+                return False
+
+            return True
 
     def export_to_csv(self):
         """Export stories to CSV file"""
-        with Progress(
-            SpinnerColumn(),
-            TextColumn("[progress.description]{task.description}"),
-            BarColumn(),
-            TaskProgressColumn(),
-            console=console
-        ) as progress:
+        with self.make_progress() as progress:
             task = progress.add_task("[cyan]Preparing CSV export...", total=None)
             
             try:
-                conn = sqlite3.connect(self.db_file)
-                cursor = conn.cursor()
-                cursor.execute('SELECT * FROM stories ORDER BY timestamp DESC')
-                stories = cursor.fetchall()
-                conn.close()
+                started = time.perf_counter()
+                total = self.db.count_stories()
 
-                if not stories:
+                if not total:
                     console.print("[yellow]No stories to export[/yellow]")
-                    return
+                    return True
+
+                progress.update(task, total=total)
 
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
                 csv_file = f"stories_export_{timestamp}.csv"
@@ -309,16 +1775,210 @@ class StoryScraper:
                 with open(csv_file, 'w', newline='', encoding='utf-8') as csvfile:
                     csv_writer = csv.writer(csvfile)
                     csv_writer.writerow(["User ID", "Story ID", "Timestamp", "Filename"])
-                    csv_writer.writerows(stories)
+                    for chunk in self.db.iter_stories():
+                        csv_writer.writerows(chunk)
+                        progress.advance(task, len(chunk))
 
-                progress.update(task, completed=True)
-                console.print(f"[green]✓[/green] Successfully exported to {csv_file}!")
+                progress.update(task, completed=total)
+                self.report_export(csv_file, total, started)
 
             except Exception as e:
                 console.print(f"[red]Error during CSV export: {str(e)}[/red]")
+                return False
+
+            return True
+
+    def cached_export_intact(self, path, cursor):
+        """Check a cached export still has the size it had when last written"""
+        return cursor is not None and os.path.exists(path) and os.path.getsize(path) == cursor[2]
+
+    def export_to_csv_cached(self, csv_file='stories_export.csv', rebuild=False):
+        """Append stories added since the last cached export to a rolling CSV file"""
+        with self.make_progress() as progress:
+            task = progress.add_task("[cyan]Updating cached CSV export...", total=None)
+
+            try:
+                started = time.perf_counter()
+                target = os.path.abspath(csv_file)
+                cursor = self.db.get_export_cursor(target)
+                # A missing file, or one whose size we did not leave it at, was
+                # edited or cut short mid-append and is rewritten from scratch.
+                if rebuild or not self.cached_export_intact(csv_file, cursor):
+                    cursor = None
+                after, row_count = cursor[:2] if cursor else (0, 0)
+                until = self.db.fetch_last_rowid()
+                rows = self.db.count_stories_between(after, until)
+
+                if cursor and not rows:
+                    console.print(f"[yellow]{csv_file} is already up to date[/yellow]")
+                    return True
+
+                progress.update(task, total=rows)
+
+                with open(csv_file, 'a' if cursor else 'w', newline='', encoding='utf-8') as csvfile:
+                    csv_writer = csv.writer(csvfile)
+                    if not cursor:
+                        csv_writer.writerow(["User ID", "Story ID", "Timestamp", "Filename"])
+                    for chunk in self.db.iter_stories_between(after, until):
+                        csv_writer.writerows(chunk)
+                        progress.advance(task, len(chunk))
+
+                self.db.set_export_cursor(target, until, row_count + rows, os.path.getsize(csv_file))
+                progress.update(task, completed=rows)
+                action = "Appended" if cursor else "Rebuilt"
+                console.print(f"[cyan]{action} {rows} rows, {row_count + rows} in total[/cyan]")
+                self.report_export(csv_file, rows, started)
+
+            except Exception as e:
+                console.print(f"[red]Error during cached CSV export: {str(e)}[/red]")
+                return False
+
+            return True
+
+    def export_to_excel_cached(self, output_dir='stories_export_xlsx', rebuild=False):
+        """Write stories added since the last cached export as a new workbook listed in a manifest"""
+        with self.make_progress() as progress:
+            task = progress.add_task("[cyan]Updating cached Excel export...", total=None)
+
+            try:
+                started = time.perf_counter()
+                manifest_file = os.path.join(output_dir, 'manifest.json')
+                target = os.path.abspath(manifest_file)
+                cursor = self.db.get_export_cursor(target)
+                if rebuild or not self.cached_export_intact(manifest_file, cursor):
+                    cursor = None
+                after, row_count = cursor[:2] if cursor else (0, 0)
+                until = self.db.fetch_last_rowid()
+                rows = self.db.count_stories_between(after, until)
+
+                if cursor and not rows:
+                    console.print(f"[yellow]{output_dir} is already up to date[/yellow]")
+                    return True
+
+                os.makedirs(output_dir, exist_ok=True)
+                manifest = {'parts': []}
+                if os.path.exists(manifest_file):
+                    with open(manifest_file, 'r') as f:
+                        manifest = json.load(f)
+                if not cursor:
+                    for part in manifest['parts']:
+                        path = os.path.join(output_dir, part['file'])
+                        if os.path.exists(path):
+                            os.remove(path)
+                    manifest = {'parts': []}
+
+                progress.update(task, total=rows)
+
+                part_file = f"part-{len(manifest['parts']) + 1:05d}.xlsx"
+                if cursor:
+                    # Deltas are small, so size the columns from the rows themselves
+                    # instead of scanning the whole table.
+                    stories = [story for chunk in self.db.iter_stories_between(after, until) for story in chunk]
+                    widths = [max(len(str(story[col])) for story in stories) for col in range(4)]
+                    chunks = [stories]
+                else:
+                    widths = self.db.fetch_column_widths()
+                    chunks = self.db.iter_stories_between(after, until)
+                self.write_workbook(os.path.join(output_dir, part_file), chunks, widths, progress, task)
+
+                manifest['parts'].append({
+                    'file': part_file,
+                    'first_rowid': after + 1,
+                    'last_rowid': until,
+                    'rows': rows,
+                    'created': datetime.now().isoformat(timespec='seconds'),
+                })
+                manifest['rows'] = row_count + rows
+                with open(manifest_file + '.tmp', 'w') as f:
+                    json.dump(manifest, f, indent=2)
+                os.replace(manifest_file + '.tmp', manifest_file)
+
+                self.db.set_export_cursor(target, until, row_count + rows, os.path.getsize(manifest_file))
+                progress.update(task, completed=rows)
+                console.print(f"[cyan]Wrote {part_file} with {rows} rows, {len(manifest['parts'])} parts in total[/cyan]")
+                self.report_export(os.path.join(output_dir, part_file), rows, started)
+
+            except Exception as e:
+                console.print(f"[red]Error during cached Excel export: {str(e)}[/red]")
+                return False
+
+            return True
+
+    def export_to_parquet(self, output_dir='stories_dataset'):
+        """Export stories to a day-partitioned Parquet dataset, rewriting only changed days"""
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            console.print("[red]Parquet export requires pyarrow (pip install pyarrow)[/red]")
+            return False
+
+        schema = pa.schema([
+            ('user_id', pa.int64()),
+            ('story_id', pa.int64()),
+            ('timestamp', pa.timestamp('s', tz='UTC')),
+            ('filename', pa.string()),
+        ])
+
+        with self.make_progress() as progress:
+            task = progress.add_task("[cyan]Preparing Parquet export...", total=None)
+
+            try:
+                started = time.perf_counter()
+                partitions = self.db.fetch_day_partitions()
+
+                if not partitions:
+                    console.print("[yellow]No stories to export[/yellow]")
+                    return True
+
+                target = os.path.abspath(output_dir)
+                exported = self.db.fetch_exported_partitions(target)
+                changed = [
+                    day for day, signature in sorted(partitions.items())
+                    if exported.get(day) != tuple(signature)
+                    or not os.path.exists(os.path.join(output_dir, f"date={day}", "part-0.parquet"))
+                ]
+                progress.update(task, total=len(changed))
+
+                rows = 0
+                for day in changed:
+                    stories = self.db.fetch_stories_for_day(day)
+                    user_ids, story_ids, timestamps, filenames = zip(*stories)
+                    table = pa.table([
+                        pa.array(user_ids, pa.int64()),
+                        pa.array(story_ids, pa.int64()),
+                        pa.array(timestamps, pa.timestamp('s', tz='UTC')),
+                        pa.array(filenames, pa.string()),
+                    ], schema=schema)
+
+                    partition_dir = os.path.join(output_dir, f"date={day}")
+                    os.makedirs(partition_dir, exist_ok=True)
+                    path = os.path.join(partition_dir, "part-0.parquet")
+                    pq.write_table(table, path + ".tmp", compression='zstd')
+                    os.replace(path + ".tmp", path)
+
+                    self.db.mark_partition_exported(target, day, *partitions[day])
+                    rows += len(stories)
+                    progress.advance(task)
+
+                progress.update(task, completed=len(changed))
+                if changed:
+                    console.print(f"[cyan]Rewrote {len(changed)} of {len(partitions)} day partitions[/cyan]")
+                    self.report_export(output_dir, rows, started)
+                else:
+                    console.print(f"[yellow]{output_dir} is already up to date[/yellow]")
+
+            except Exception as e:
+                console.print(f"[red]Error during Parquet export: {str(e)}[/red]")
+                return False
+
+            return True
 
     def export_data(self):
         """Export data menu"""
+        from rich.panel import Panel
+        from rich.prompt import Prompt
+        from rich.table import Table
         while True:
             console.clear()
             display_export_banner()
@@ -332,11 +1992,15 @@ class StoryScraper:
             menu.add_row("[white]   ├─ Simple text-based format[/white]")
             menu.add_row("[white]   └─ Best for data portability[/white]")
             menu.add_row("")
-            menu.add_row("[cyan][[/cyan]3[cyan]][/cyan] [bold]Back to Main Menu[/bold]")
+            menu.add_row("[cyan][[/cyan]3[cyan]][/cyan] [bold]Export to Parquet dataset[/bold]")
+            menu.add_row("[white]   ├─ Columnar, compressed, partitioned by day[/white]")
+            menu.add_row("[white]   └─ Only changed days are rewritten[/white]")
+            menu.add_row("")
+            menu.add_row("[cyan][[/cyan]4[cyan]][/cyan] [bold]Back to Main Menu[/bold]")
             
             console.print(Panel(menu, title="[bold blue]Export Options[/bold blue]", border_style="cyan"))
             
-            choice = Prompt.ask("Select export format", choices=["1", "2", "3"])
+            choice = Prompt.ask("Select export format", choices=["1", "2", "3", "4"])
             
             if choice == "1":
                 self.export_to_excel()
@@ -345,50 +2009,67 @@ class StoryScraper:
                 self.export_to_csv()
                 input("\nPress Enter to continue...")
             elif choice == "3":
+                self.export_to_parquet()
+                input("\nPress Enter to continue...")
+            elif choice == "4":
                 break
 
-    def show_statistics(self):
-        """Display statistics about scraped stories"""
+    def statistics(self):
+        """Collect the statistics shown by the menu and the stats command"""
+        total_stories, unique_users, last_story, today_stories = self.db.fetch_statistics()
+        if self.story_index is not None:
+            index_size = f"{self.story_index.memory_usage() / 1024:.1f} KiB ({len(self.story_index)} keys)"
+        else:
+            # Loading the index just to report on it would cost what it measures
+            estimate = StoryIndex.estimate_memory(total_stories or 0) / 1024
+            index_size = f"~{estimate:.1f} KiB when loaded ({total_stories or 0} keys, {self.dedupe_mode} mode)"
+        return {
+            'total_stories': total_stories,
+            'unique_users': unique_users,
+            'stories_today': today_stories,
+            'last_story': last_story,
+            'dedupe_index': index_size,
+        }
+
+    def print_statistics(self):
+        """Print statistics about scraped stories"""
+        from rich import box
+        from rich.panel import Panel
+        from rich.table import Table
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT COUNT(*) FROM stories')
-            total_stories = cursor.fetchone()[0]
-            
-            cursor.execute('SELECT COUNT(DISTINCT user_id) FROM stories')
-            unique_users = cursor.fetchone()[0]
-            
-            cursor.execute('SELECT MAX(timestamp) FROM stories')
-            last_story = cursor.fetchone()[0]
-            
-            cursor.execute('SELECT COUNT(*) FROM stories WHERE date(timestamp) = date("now")')
-            today_stories = cursor.fetchone()[0]
-            
-            conn.close()
+            stats = self.statistics()
 
             stats_table = Table(title="Stories Statistics", box=box.ROUNDED)
             stats_table.add_column("Metric", style="cyan")
             stats_table.add_column("Value", style="green")
             
-            stats_table.add_row("Total Stories", str(total_stories))
-            stats_table.add_row("Unique Users", str(unique_users))
-            stats_table.add_row("Stories Today", str(today_stories))
-            stats_table.add_row("Last Story Date", str(last_story))
+            stats_table.add_row("Total Stories", str(stats['total_stories']))
+            stats_table.add_row("Unique Users", str(stats['unique_users']))
+            stats_table.add_row("Stories Today", str(stats['stories_today']))
+            stats_table.add_row("Last Story Date", str(stats['last_story']))
+            stats_table.add_row("Dedupe Index Memory", stats['dedupe_index'])
             
             console.print(Panel(stats_table, border_style="cyan"))
             
         except Exception as e:
             console.print(f"[red]Error getting statistics: {str(e)}[/red]")
-        
+            return False
+
+        return True
+
+    def show_statistics(self):
+        """Display statistics about scraped stories"""
+        self.print_statistics()
         input("\nPress Enter to continue...")
 
     def prompt_for_interval(self):
         """Prompt for checking interval"""
+        from rich.prompt import IntPrompt
         return IntPrompt.ask("Enter the checking interval in seconds", default=60)
 
     def start_scraping(self, interval):
         """Start the scraping process"""
+        import schedule
         console.print(f"[cyan]Starting scraper with {interval}-second interval[/cyan]")
         console.print("[yellow]Press Ctrl+C to stop and return to menu[/yellow]")
         
@@ -416,8 +2097,60 @@ class StoryScraper:
             console.print(f"[red]Error during scraping: {str(e)}[/red]")
             time.sleep(2)
 
+    async def flush_database(self):
+        """Write any buffered story rows"""
+        self.db.flush()
+
+    async def run_daemon(self, interval, jitter=0.0, flush_interval=5, export_interval=None,
+                         export_format='parquet', export_output='stories_dataset', drain_timeout=300,
+                         headless=True):
+        """Run scraping, DB flushing and exports in a single event loop"""
+        self.headless = self.headless or headless
+        if not await self.initialize_client():
+            self.db.close()
+            return False
+
+        os.makedirs('stories', exist_ok=True)
+        scheduler = AsyncScheduler()
+
+        def request_stop():
+            if not self.stopping:
+                console.print("[yellow]Shutting down, finishing in-flight downloads...[/yellow]")
+            self.stopping = True
+            scheduler.stop()
+
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, request_stop)
+            except (NotImplementedError, RuntimeError):
+                signal.signal(sig, lambda *_: loop.call_soon_threadsafe(request_stop))
+
+        scheduler.every(interval, self.scrape_stories, 'scrape', jitter=jitter)
+        scheduler.every(flush_interval, self.flush_database, 'flush', run_immediately=False)
+        if export_interval:
+            async def export_job():
+                await asyncio.to_thread(run_export, export_format, export_output, True, True)
+            scheduler.every(export_interval, export_job, 'export', run_immediately=False)
+
+        console.print(f"[cyan]Daemon started with {interval}-second interval[/cyan]")
+        try:
+            await scheduler.run(drain_timeout)
+        finally:
+            if self.processor:
+                await self.processor.close(drain_timeout)
+            self.output.stop()
+            self.db.close()
+            if self.client and self.client.is_connected():
+                await self.client.disconnect()
+            console.print("[yellow]Daemon stopped[/yellow]")
+        return True
+
     def show_menu(self):
         """Display and handle the main menu"""
+        from rich.panel import Panel
+        from rich.prompt import Prompt
+        from rich.table import Table
         try:
             loop = asyncio.get_event_loop()
             
@@ -452,40 +2185,637 @@ class StoryScraper:
                         async def disconnect():
                             await self.client.disconnect()
                         loop.run_until_complete(disconnect())
+                    if self.processor:
+                        loop.run_until_complete(self.processor.close())
+                    self.output.stop()
+                    self.db.close()
                     console.print("[yellow]Goodbye![/yellow]")
                     break
                     
         except Exception as e:
             console.print(f"[red]Error in menu: {str(e)}[/red]")
-def main():
+class HashRing:
+    """Consistent hash ring assigning peers to accounts"""
+
+    def __init__(self, nodes, replicas=100):
+        self.ring = sorted((self.hash(f"{node}#{i}"), node) for node in nodes for i in range(replicas))
+        self.hashes = [h for h, _ in self.ring]
+
+    @staticmethod
+    def hash(key):
+        return int.from_bytes(hashlib.md5(str(key).encode()).digest()[:8], 'big')
+
+    def owner(self, key, candidates=None):
+        """Return the first node clockwise from key, limited to candidates if given"""
+        start = bisect.bisect(self.hashes, self.hash(key))
+        for i in range(len(self.ring)):
+            node = self.ring[(start + i) % len(self.ring)][1]
+            if candidates is None or node in candidates:
+                return node
+        return None
+
+class PeerAssigner:
+    """Gives every peer to exactly one live account, settled by the coordinator"""
+
+    def __init__(self, names, db):
+        self.ring = HashRing(names)
+        self.db = db
+        self.live = set(names)
+        self.claimed = set()
+        self.pending = []
+        self.viewers = {}
+        self.owners = {}
+        self.current = {}
+        self.stale = set()
+
+    @staticmethod
+    def sync_state_name(account):
+        return f"all_stories:{account}"
+
+    def submit(self, account, claim, user_ids):
+        """Queue a worker's claim and return the (account, claim, owned) answers that can be sent
+
+        The first round waits until every live account has reported its peers, so
+        the ring sees who can download each peer before anyone starts.
+        """
+        self.pending.append((account, claim, user_ids))
+        self.claimed.add(account)
+        self.stale.discard(self.sync_state_name(account))
+        return self.answer()
+
+    def release(self, account):
+        """Forget an account that has stopped and hand its peers to the others"""
+        self.live.discard(account)
+        for user_id, owner in list(self.owners.items()):
+            if owner == account:
+                del self.owners[user_id]
+        # The survivors' sync states were advanced without these peers, so a poll
+        # would answer "not modified" and they would never be claimed. Clear the
+        # states, and ignore states from cycles assigned before this release.
+        for name in self.live:
+            self.db.set_sync_state(self.sync_state_name(name), None)
+            self.stale.add(self.sync_state_name(name))
+        return self.answer()
+
+    def accept_sync_state(self, name):
+        """Return whether a sync state sent by a worker may be saved"""
+        return name not in self.stale
+
+    def answer(self):
+        if not self.live <= self.claimed:
+            return []
+        pending, self.pending = self.pending, []
+        for account, _, user_ids in pending:
+            self.record(account, user_ids)
+        return [(account, claim, self.assign(account, user_ids)) for account, claim, user_ids in pending]
+
+    def record(self, account, user_ids):
+        """Note which peers an account sees now, dropping the ones it no longer sees"""
+        seen = set(user_ids)
+        self.db.record_account_peers(account, seen)
+        unknown = [user_id for user_id in seen if user_id not in self.viewers]
+        for user_id, accounts in self.db.fetch_peer_accounts(unknown).items():
+            self.viewers[user_id] = set(accounts)
+        for user_id in seen:
+            self.viewers.setdefault(user_id, set()).add(account)
+        for user_id in self.current.get(account, set()) - seen:
+            self.viewers[user_id].discard(account)
+        # An owner that stopped reporting a peer, for example one it no longer follows,
+        # gives it up so another account can take it on its next claim.
+        for user_id, owner in list(self.owners.items()):
+            if owner == account and user_id not in seen:
+                del self.owners[user_id]
+                self.viewers[user_id].discard(account)
+        self.current[account] = seen
+
+    def assign(self, account, user_ids):
+        """Return the peers among user_ids that account owns, keeping earlier owners"""
+        owned = []
+        for user_id in user_ids:
+            owner = self.owners.get(user_id)
+            if owner not in self.live:
+                owner = self.ring.owner(user_id, self.viewers[user_id] & self.live)
+                self.owners[user_id] = owner
+            if owner == account:
+                owned.append(user_id)
+        return owned
+
+class ShardDatabase(StoryDatabase):
+    """Read-only stories database for a worker process; writes go to the single writer"""
+
+    def __init__(self, db_file, results):
+        self.results = results
+        super().__init__(db_file)
+
+    def initialize(self):
+        pass
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+
+    def add_story(self, user_id, story_id, timestamp, filename, media_key=None):
+        self.results.put(('story', (user_id, story_id, timestamp, filename, media_key)))
+
+    def add_story_metadata(self, row):
+        self.results.put(('metadata', (row,)))
+
+    def add_media(self, media_key, path, sha256, size):
+        self.results.put(('media', (media_key, path, sha256, size)))
+
+    def set_sync_state(self, name, value):
+        self.results.put(('sync_state', (name, value)))
+
+    def save_partial_offset(self, part_file, offset):
+        self.results.put(('partial', (part_file, offset)))
+
+    def save_processing_result(self, filename, result):
+        self.results.put(('processed', (filename, result)))
+
+    def mark_processing_deferred(self, filename):
+        self.results.put(('deferred', (filename,)))
+
+    def clear_partial_offset(self, part_file):
+        self.results.put(('partial_done', (part_file,)))
+
+    def record_missed_stories(self, rows):
+        self.results.put(('missed', (rows,)))
+
+    def clear_missed_stories(self, keys):
+        self.results.put(('missed_done', (keys,)))
+
+class ShardWorker(StoryScraper):
+    """Scrapes the peers one account owns on the hash ring"""
+
+    def __init__(self, account, results, replies, claim_timeout=30):
+        self.account = account
+        self.results = results
+        self.replies = replies
+        self.claim_timeout = claim_timeout
+        self.claims = 0
+        super().__init__()
+        self.credentials = account
+        self.session_name = account['session']
+        self.sync_state_name = PeerAssigner.sync_state_name(account['name'])
+        self.dedupe_mode = 'lookup'
+        self.headless = True
+        self.interactive = False
+
+    def initialize_database(self):
+        self.db = ShardDatabase(self.db_file, self.results)
+
+    async def select_peer_stories(self, peer_stories):
+        """Keep the peers the coordinator assigned to this account"""
+        self.claims += 1
+        user_ids = [peer_story.peer.user_id for peer_story in peer_stories]
+        self.results.put(('claim', (self.account['name'], self.claims, user_ids)))
+        deadline = time.monotonic() + self.claim_timeout
+        while True:
+            try:
+                # Wait in a thread so Telethon keeps running while other accounts catch up
+                claim, owned = await asyncio.to_thread(
+                    self.replies.get, True, max(deadline - time.monotonic(), 0.01)
+                )
+            except Empty:
+                # Raising keeps the sync state where it is, so these stories are offered again
+                raise RuntimeError("no peer assignment from the coordinator")
+            if claim == self.claims:
+                break
+        owned = set(owned)
+        return [peer_story for peer_story in peer_stories if peer_story.peer.user_id in owned]
+
+    async def run_shard(self, interval, stop_event, jitter=0.0):
+        """Scrape on an interval until the coordinator sets stop_event"""
+        if not await self.initialize_client():
+            return
+
+        os.makedirs('stories', exist_ok=True)
+        scheduler = AsyncScheduler()
+
+        async def watch_stop():
+            if stop_event.is_set():
+                self.stopping = True
+                scheduler.stop()
+
+        scheduler.every(interval, self.scrape_stories, 'scrape', jitter=jitter)
+        scheduler.every(1, watch_stop, 'watch_stop')
+        try:
+            await scheduler.run()
+        finally:
+            self.output.stop()
+            self.db.close()
+            if self.client and self.client.is_connected():
+                await self.client.disconnect()
+
+def run_shard_worker(account, results, replies, stop_event, interval, client_factory=None,
+                     options=None, jitter=0.0):
+    """Worker process entry point for one account"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        worker = ShardWorker(account, results, replies)
+        if client_factory is not None:
+            worker.client_factory = client_factory
+        if options is not None:
+            configure_scraper(worker, options)
+            # Keep each account's metrics and profiles apart
+            if worker.metrics_log:
+                root, ext = os.path.splitext(worker.metrics_log)
+                worker.metrics_log = f"{root}.{account['name']}{ext}"
+            if worker.profile_dir:
+                worker.profile_dir = os.path.join(worker.profile_dir, account['name'])
+        asyncio.run(worker.run_shard(interval, stop_event, jitter))
+    except Exception as e:
+        console.print(f"[red]Account {account['name']} stopped: {str(e)}[/red]")
+    finally:
+        results.put(('exit', account['name']))
+
+def load_accounts(accounts_file):
+    """Load the list of account credentials and give each a name and session"""
+    with open(accounts_file, 'r') as f:
+        accounts = json.load(f)
+    for i, account in enumerate(accounts):
+        account.setdefault('name', account.get('session') or f"account{i + 1}")
+        account.setdefault('session', account['name'])
+    return accounts
+
+def run_accounts(accounts, interval, db_file='stories.db', client_factory=None, stop_event=None,
+                 options=None, jitter=0.0, export_interval=None, export_format='parquet',
+                 export_output='stories_dataset'):
+    """Scrape with one worker process per account, writing results from this process only
+
+    options is the parsed command line applied to every worker with
+    configure_scraper; exports run here, in the only process that writes.
+    """
+    db = StoryDatabase(db_file)
+    names = [account['name'] for account in accounts]
+    import multiprocessing
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    replies = {name: context.Queue() for name in names}
+    stop_event = stop_event or context.Event()
+    assigner = PeerAssigner(names, db)
+    workers = [
+        context.Process(target=run_shard_worker, name=f"tgss-{account['name']}",
+                        args=(account, results, replies[account['name']], stop_event, interval, client_factory,
+                              options, jitter))
+        for account in accounts
+    ]
+    for worker in workers:
+        worker.start()
+    console.print(f"[cyan]Started {len(workers)} account workers with {interval}-second interval[/cyan]")
+
+    try:
+        signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    except ValueError:
+        pass
+
+    running = len(workers)
+    next_export = time.monotonic() + export_interval if export_interval else None
+    try:
+        while running:
+            if next_export and time.monotonic() >= next_export:
+                db.flush()
+                run_export(export_format, export_output, True, True)
+                next_export = time.monotonic() + export_interval
+            try:
+                kind, payload = results.get(timeout=1)
+            except Empty:
+                db.flush()
+                if not any(worker.is_alive() for worker in workers):
+                    break
+                continue
+            except KeyboardInterrupt:
+                console.print("[yellow]Stopping account workers...[/yellow]")
+                stop_event.set()
+                continue
+
+            answers = []
+            if kind == 'story':
+                db.add_story(*payload)
+            elif kind == 'media':
+                db.add_media(*payload)
+            elif kind == 'sync_state':
+                if assigner.accept_sync_state(payload[0]):
+                    db.set_sync_state(*payload)
+            elif kind == 'claim':
+                answers = assigner.submit(*payload)
+            elif kind == 'partial':
+                db.save_partial_offset(*payload)
+            elif kind == 'partial_done':
+                db.clear_partial_offset(*payload)
+            elif kind == 'processed':
+                db.save_processing_result(*payload)
+            elif kind == 'deferred':
+                db.mark_processing_deferred(*payload)
+            elif kind == 'metadata':
+                db.add_story_metadata(*payload)
+            elif kind == 'missed':
+                db.record_missed_stories(*payload)
+            elif kind == 'missed_done':
+                db.clear_missed_stories(*payload)
+            elif kind == 'exit':
+                running -= 1
+                answers = assigner.release(payload)
+
+            for account, claim, owned in answers:
+                replies[account].put((claim, owned))
+    finally:
+        stop_event.set()
+        for worker in workers:
+            worker.join()
+        db.close()
+
+def scraper_options(suppress=False):
+    """Return a parent parser with the options shared by the menu, scrape and daemon
+
+    The copies given to subcommands use SUPPRESS defaults, so they only set an
+    option when it is passed after the command and never reset one passed before it.
+    """
+    def default(value):
+        return argparse.SUPPRESS if suppress else value
+
+    def positive_int(value):
+        number = int(value)
+        if number < 1:
+            raise argparse.ArgumentTypeError(f"{value} is not a positive integer")
+        return number
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--concurrency', type=positive_int, metavar='N', default=default(None),
+                        help="downloads running at the same time (default 5)")
+    common.add_argument('--per-peer', type=positive_int, metavar='N', default=default(None),
+                        help="downloads running at the same time for one peer (default 2)")
+    common.add_argument('--dedupe-mode', choices=['index', 'lookup'], default=default(None),
+                        help="check for known stories with an in-memory index, or with database lookups "
+                             "that use less memory (default index)")
+    common.add_argument('--metrics-port', type=int, default=default(None),
+                        help="serve Prometheus metrics on 127.0.0.1:PORT/metrics")
+    common.add_argument('--metrics-log', metavar='FILE', default=default(None),
+                        help="append per-cycle metrics as JSON lines to FILE")
+    common.add_argument('--profile-dir', metavar='DIR', default=default(None),
+                        help="write a cProfile dump of every scrape cycle to DIR")
+    common.add_argument('--process-media', action='store_true', default=default(False),
+                        help="build thumbnails and perceptual hashes of downloads in a process pool")
+    common.add_argument('--processing-workers', type=int, default=default(2),
+                        help="worker processes for media processing")
+    common.add_argument('--transcode', action='store_true', default=default(False),
+                        help="also re-encode videos to a smaller H.264 copy (needs ffmpeg)")
+    common.add_argument('--priorities', metavar='FILE', default=default(None),
+                        help="JSON object of user_id to priority weight; higher is fetched first")
+    common.add_argument('--cycle-budget-mb', type=float, default=default(None),
+                        help="stop starting new downloads once a cycle has transferred this many MB")
+    common.add_argument('--quiet', action='store_true', default=default(False),
+                        help="no progress bars or summaries, only errors")
+    common.add_argument('--content-addressed', action='store_true', default=default(False),
+                        help="store each distinct media file once under stories/objects/ and hardlink stories to it")
+    return common
+
+def parse_args(argv=None):
+    common = scraper_options(suppress=True)
+    parser = argparse.ArgumentParser(description="Telegram Story Scraper", parents=[scraper_options()],
+                                     epilog="Run without a command for the interactive menu.")
+    commands = parser.add_subparsers(dest='command', metavar='COMMAND')
+
+    scrape = commands.add_parser('scrape', parents=[common],
+                                 help="check for new stories without the menu")
+    scrape.add_argument('--once', action='store_true',
+                        help="run a single scrape cycle and exit")
+    scrape.add_argument('--interval', type=int, default=60,
+                        help="seconds between story checks")
+    scrape.add_argument('--jitter', type=float, default=0.0,
+                        help="random extra delay in seconds added to each check")
+
+    daemon = commands.add_parser('daemon', parents=[common],
+                                 help="run headless in the background until SIGTERM")
+    daemon.add_argument('--interval', type=int, default=60,
+                        help="seconds between story checks")
+    daemon.add_argument('--jitter', type=float, default=0.0,
+                        help="random extra delay in seconds added to each check")
+    daemon.add_argument('--accounts', metavar='FILE',
+                        help="JSON list of account credentials to scrape with in parallel "
+                             "(not with --metrics-port or --process-media)")
+    daemon.add_argument('--export-interval', type=int, default=None,
+                        help="seconds between background exports; CSV and XLSX use the cached mode")
+    daemon.add_argument('--export-format', choices=['xlsx', 'csv', 'parquet'], default='parquet',
+                        help="format of background exports")
+    daemon.add_argument('--output', default='stories_dataset',
+                        help="output directory for the parquet dataset")
+
+    export = commands.add_parser('export', help="export the stories database and exit")
+    export.add_argument('--format', dest='export_format', choices=['xlsx', 'csv', 'parquet'], default='csv',
+                        help="export format")
+    export.add_argument('--output', default='stories_dataset',
+                        help="output directory for the parquet dataset")
+    export.add_argument('--cached', action='store_true',
+                        help="append new stories to the cached CSV, or add an XLSX delta part")
+    export.add_argument('--rebuild', action='store_true',
+                        help="rewrite the cached export from scratch (implies --cached)")
+    export.add_argument('--quiet', action='store_true', default=argparse.SUPPRESS,
+                        help="no progress bars")
+
+    stats = commands.add_parser('stats', help="print database statistics and exit")
+    stats.add_argument('--json', action='store_true',
+                       help="print the statistics as JSON")
+
+    query = commands.add_parser('query', help="search stored stories and their metadata offline")
+    query.add_argument('--peer', type=int, action='append', dest='peers', metavar='USER_ID',
+                       help="only stories from this user; repeat for several")
+    query.add_argument('--since', metavar='YYYY-MM-DD',
+                       help="only stories posted on or after this day")
+    query.add_argument('--until', metavar='YYYY-MM-DD',
+                       help="only stories posted on or before this day")
+    query.add_argument('--type', dest='media_type', metavar='TYPE',
+                       help="media type: photo, video, image, audio or application")
+    query.add_argument('--min-size', type=float, metavar='MB',
+                       help="only media of at least this many MB")
+    query.add_argument('--max-size', type=float, metavar='MB',
+                       help="only media of at most this many MB")
+    query.add_argument('--limit', type=int, default=50,
+                       help="maximum number of stories to show, 0 for all")
+    query.add_argument('--json', action='store_true',
+                       help="print one JSON object per story")
+
+    args = parser.parse_args(argv)
+    if args.command == 'daemon' and args.accounts:
+        # Each account runs in its own process: one port cannot serve them all, and
+        # media processing would write to the database outside the single writer.
+        for option, value in (('--metrics-port', args.metrics_port), ('--process-media', args.process_media),
+                              ('--transcode', args.transcode)):
+            if value:
+                parser.error(f"{option} cannot be combined with --accounts")
+    return args
+
+def configure_scraper(scraper, args):
+    """Apply the instrumentation, scheduling and media processing options"""
+    scraper.metrics_log = args.metrics_log
+    scraper.profile_dir = args.profile_dir
+    scraper.content_addressed = args.content_addressed
+    if args.concurrency:
+        scraper.max_concurrent_downloads = args.concurrency
+    if args.per_peer:
+        scraper.max_downloads_per_peer = args.per_peer
+    if args.dedupe_mode:
+        scraper.dedupe_mode = args.dedupe_mode
+    if args.quiet:
+        scraper.headless = True
+        scraper.output.quiet = True
+    if args.priorities:
+        with open(args.priorities, 'r') as f:
+            scraper.peer_priorities = {int(user_id): float(weight) for user_id, weight in json.load(f).items()}
+    if args.cycle_budget_mb:
+        scraper.cycle_byte_budget = int(args.cycle_budget_mb * 1024 * 1024)
+    if args.metrics_port:
+        start_metrics_server(scraper.metrics, args.metrics_port)
+    if args.process_media:
+        scraper.processor = MediaProcessor(scraper.db, scraper.metrics, workers=args.processing_workers,
+                                           transcode=args.transcode)
+
+def run_export(export_format, output, headless=False, cached=False, rebuild=False):
+    """Run a single export without the interactive menu, returning whether it succeeded"""
+    scraper = StoryScraper()
+    scraper.headless = headless
+    try:
+        if export_format == 'xlsx' and cached:
+            return scraper.export_to_excel_cached(rebuild=rebuild)
+        elif export_format == 'xlsx':
+            return scraper.export_to_excel()
+        elif export_format == 'csv' and cached:
+            return scraper.export_to_csv_cached(rebuild=rebuild)
+        elif export_format == 'csv':
+            return scraper.export_to_csv()
+        else:
+            return scraper.export_to_parquet(output)
+    finally:
+        scraper.db.close()
+
+def run_stats(as_json=False):
+    """Print database statistics without connecting to Telegram"""
+    scraper = StoryScraper()
+    try:
+        if as_json:
+            print(json.dumps(scraper.statistics(), default=str))
+            return True
+        return scraper.print_statistics()
+    finally:
+        scraper.db.close()
+
+def run_scrape(args):
+    """Scrape once or on an interval without the interactive menu, returning whether it succeeded"""
+    scraper = StoryScraper()
+    scraper.interactive = False
+    configure_scraper(scraper, args)
+    if not args.once:
+        return asyncio.run(scraper.run_daemon(args.interval, jitter=args.jitter, headless=False))
+
+    async def scrape_once():
+        try:
+            if not await scraper.initialize_client():
+                return False
+            os.makedirs('stories', exist_ok=True)
+            return await scraper.scrape_stories()
+        finally:
+            if scraper.processor:
+                await scraper.processor.close()
+            scraper.output.stop()
+            scraper.db.close()
+            if scraper.client and scraper.client.is_connected():
+                await scraper.client.disconnect()
+    return asyncio.run(scrape_once())
+
+def run_menu(args):
+    """Run the interactive menu on a single event loop"""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
     try:
         console.clear()
         display_banner()
-        
-        try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-        except Exception:
-            loop = asyncio.get_event_loop_policy().new_event_loop()
-            asyncio.set_event_loop(loop)
-            
-        with asyncio.Runner() as runner:
-            scraper = StoryScraper()
-            runner.run(scraper.initialize_client())
-            scraper.show_menu()
-            
+        scraper = StoryScraper()
+        configure_scraper(scraper, args)
+        scraper.show_menu()
     except Exception as e:
         console.print(f"[red]Critical error: {str(e)}[/red]")
         input("Press Enter to exit...")
     finally:
         try:
             pending = asyncio.all_tasks(loop)
+            for task in pending:
+                task.cancel()
             loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
-        except Exception:
-            pass
         finally:
-            if loop and not loop.is_closed():
-                loop.close()
+            asyncio.set_event_loop(None)
+            loop.close()
+
+def parse_day(day, days=0):
+    """Return the epoch second a local YYYY-MM-DD day starts, shifted by days"""
+    start = datetime.strptime(day, '%Y-%m-%d').replace(tzinfo=timezone(UTC_OFFSET))
+    return int((start + timedelta(days=days)).timestamp())
+
+def run_query(args):
+    """Print stored stories matching the filters without connecting to Telegram"""
+    db = StoryDatabase('stories.db')
+    try:
+        rows = db.query_stories(
+            user_ids=args.peers,
+            since=parse_day(args.since) if args.since else None,
+            until=parse_day(args.until, days=1) if args.until else None,
+            media_type=args.media_type,
+            min_size=int(args.min_size * 1024 * 1024) if args.min_size is not None else None,
+            max_size=int(args.max_size * 1024 * 1024) if args.max_size is not None else None,
+            limit=args.limit,
+        )
+    finally:
+        db.close()
+
+    columns = ('user_id', 'story_id', 'timestamp', 'filename', 'media_type', 'mime_type',
+               'size', 'duration', 'views', 'expires', 'caption', 'extra')
+    if args.json:
+        for row in rows:
+            story = dict(zip(columns, row))
+            story['extra'] = json.loads(story['extra']) if story['extra'] else {}
+            print(json.dumps(story, ensure_ascii=False))
+        return
+
+    from rich import box
+    from rich.table import Table
+    table = Table(title=f"{len(rows)} stories", box=box.ROUNDED)
+    for header in ("User ID", "Story ID", "Posted", "Type", "Size", "Duration", "Views", "Caption", "Filename"):
+        table.add_column(header)
+    for user_id, story_id, posted, filename, media_type, _, size, duration, views, _, caption, _ in rows:
+        table.add_row(
+            str(user_id), str(story_id), posted, media_type or "",
+            f"{size / (1024 * 1024):.1f} MB" if size else "",
+            f"{duration:.0f}s" if duration else "",
+            str(views) if views is not None else "",
+            (caption or "")[:40], filename,
+        )
+    console.print(table)
+
+def main():
+    args = parse_args()
+    succeeded = True
+    if args.command == 'export':
+        succeeded = run_export(args.export_format, args.output, args.quiet, args.cached or args.rebuild, args.rebuild)
+    elif args.command == 'stats':
+        succeeded = run_stats(args.json)
+    elif args.command == 'query':
+        run_query(args)
+    elif args.command == 'scrape':
+        succeeded = run_scrape(args)
+    elif args.command == 'daemon' and args.accounts:
+        run_accounts(load_accounts(args.accounts), args.interval, options=args, jitter=args.jitter,
+                     export_interval=args.export_interval, export_format=args.export_format,
+                     export_output=args.output)
+    elif args.command == 'daemon':
+        scraper = StoryScraper()
+        scraper.interactive = False
+        configure_scraper(scraper, args)
+        succeeded = asyncio.run(scraper.run_daemon(args.interval, jitter=args.jitter,
+                                                   export_interval=args.export_interval,
+                                                   export_format=args.export_format,
+                                                   export_output=args.output))
+    else:
+        run_menu(args)
+    if not succeeded:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,406 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import sqlite3
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from telethon.errors import FloodWaitError
+from telethon.tl.types import MessageMediaPhoto, MessageMediaDocument, Photo, Document, PeerUser, StoriesStealthMode
+from telethon.tl.types.stories import AllStoriesNotModified
+import TGSS
+from TGSS import StoryDatabase, StoryScraper
+
+
+class FakeTelegramClient:
+    """Offline stand-in for TelegramClient serving synthetic stories"""
+
+    def __init__(self, peers=50, stories_per_peer=3, latency=0.02, bandwidth=20.0,
+                 photo_size=150 * 1024, video_size=2 * 1024 * 1024, video_ratio=0.3,
+                 flood_rate=0.0, flood_seconds=1, seed=0, download_log=None, post_every=1, page_size=None):
+        self.peers = peers
+        self.stories_per_peer = stories_per_peer
+        self.latency = latency
+        self.bandwidth = bandwidth * 1024 * 1024
+        self.photo_size = photo_size
+        self.video_size = video_size
+        self.video_ratio = video_ratio
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.download_log = download_log
+        self.post_every = post_every
+        self.page_size = page_size or peers
+        self.requests = 0
+        self.polls = 0
+        self.not_modified = 0
+        self.floods = 0
+
+    async def connect(self):
+        pass
+
+    async def is_user_authorized(self):
+        return True
+
+    def is_connected(self):
+        return True
+
+    async def disconnect(self):
+        pass
+
+    async def __call__(self, request):
+        """Answer GetAllStoriesRequest like Telegram does
+
+        Every peer posts a fresh set of stories once per post_every polls; a
+        poll sent with the state of the current set is answered with
+        AllStoriesNotModified. Responses are split into pages of page_size
+        peers, followed with next=True. Story ids depend only on the poll
+        number, so clients of several accounts following the same peers see
+        the same stories in each cycle.
+        """
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        if request.next:
+            version, page = (int(part) for part in request.state.split('-')[1:])
+        else:
+            self.polls += 1
+            version, page = (self.polls - 1) // self.post_every, 0
+            if request.state == f"state-{version}":
+                self.not_modified += 1
+                return AllStoriesNotModified(state=request.state, stealth_mode=StoriesStealthMode())
+
+        now = datetime.now(timezone.utc)
+        first_id = version * self.stories_per_peer + 1
+        peers = range(page * self.page_size, min((page + 1) * self.page_size, self.peers))
+        peer_stories = []
+        for peer in peers:
+            stories = [
+                SimpleNamespace(id=story_id, date=now, media=self.make_media(peer, story_id))
+                for story_id in range(first_id, first_id + self.stories_per_peer)
+            ]
+            peer_stories.append(SimpleNamespace(peer=PeerUser(user_id=100000 + peer), stories=stories))
+        has_more = peers.stop < self.peers
+        state = f"state-{version}-{page + 1}" if has_more else f"state-{version}"
+        return SimpleNamespace(peer_stories=peer_stories, has_more=has_more, state=state)
+
+    def make_media(self, peer, story_id):
+        # Seeded per story so every client serves the same media for the same story
+        rng = random.Random(f"{self.seed}:{peer}:{story_id}")
+        media_id = rng.getrandbits(62)
+        if rng.random() < self.video_ratio:
+            document = Document(id=media_id, access_hash=media_id, file_reference=b'', date=None,
+                                mime_type='video/mp4', size=self.video_size, dc_id=2, attributes=[])
+            return MessageMediaDocument(document=document)
+        photo = Photo(id=media_id, access_hash=media_id, file_reference=b'', date=None, sizes=[], dc_id=2)
+        return MessageMediaPhoto(photo=photo)
+
+    async def maybe_flood(self):
+        if self.flood_rate and self.random.random() < self.flood_rate:
+            self.floods += 1
+            raise FloodWaitError(request=None, capture=self.flood_seconds)
+
+    def log_download(self, media):
+        """Append the id of downloaded media to download_log, one line per download"""
+        if self.download_log:
+            with open(self.download_log, 'a') as f:
+                f.write(f"{type(media).__name__}:{media.id}\n")
+
+    async def download_media(self, media, file):
+        """Simulate a photo download: latency plus transfer time at the configured bandwidth"""
+        await self.maybe_flood()
+        self.log_download(media)
+        await asyncio.sleep(self.latency + self.photo_size / self.bandwidth)
+        with open(file, 'wb') as f:
+            f.write(os.urandom(self.photo_size))
+        return file
+
+    async def iter_download(self, document, offset=0, request_size=512 * 1024, file_size=None):
+        """Simulate a ranged document download"""
+        await self.maybe_flood()
+        if not offset:
+            self.log_download(document)
+        await asyncio.sleep(self.latency)
+        size = file_size or document.size
+        while offset < size:
+            chunk = min(request_size, size - offset)
+            await asyncio.sleep(chunk / self.bandwidth)
+            yield os.urandom(chunk)
+            offset += chunk
+
+
+class FakeClientFactory:
+    """Picklable StoryScraper.client_factory that builds FakeTelegramClients
+
+    Called like TelegramClient with (session, api_id, api_hash); the
+    credentials are ignored and every client gets the same options.
+    """
+
+    def __init__(self, **options):
+        self.options = options
+
+    def __call__(self, session, api_id, api_hash):
+        return FakeTelegramClient(**self.options)
+
+
+def percentile(values, pct):
+    """Return the pct-th percentile of values"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def make_rows(count):
+    """Generate synthetic story rows"""
+    return [
+        (1000 + i % 250, i, 1731369600 + i * 60, f"stories/{1000 + i % 250}_{i}.jpg")
+        for i in range(count)
+    ]
+
+
+def bench_per_row_connection(db_file, rows):
+    """Insert rows the old way: one connection and one commit per story"""
+    conn = sqlite3.connect(db_file)
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS stories (
+        user_id INTEGER,
+        story_id INTEGER PRIMARY KEY,
+        timestamp TEXT,
+        filename TEXT
+    )
+    ''')
+    conn.commit()
+    conn.close()
+
+    start = time.perf_counter()
+    for row in rows:
+        conn = sqlite3.connect(db_file)
+        conn.execute('''
+        INSERT OR IGNORE INTO stories (user_id, story_id, timestamp, filename)
+        VALUES (?, ?, ?, ?)
+        ''', row)
+        conn.commit()
+        conn.close()
+    return time.perf_counter() - start
+
+
+def bench_batched(db_file, rows):
+    """Insert rows through the pooled, batched StoryDatabase"""
+    db = StoryDatabase(db_file)
+    start = time.perf_counter()
+    for row in rows:
+        db.add_story(*row)
+    db.flush()
+    elapsed = time.perf_counter() - start
+    db.close()
+    return elapsed
+
+
+def bench_inserts(count=5000):
+    """Compare insert throughput of the per-row and batched paths"""
+    rows = make_rows(count)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, bench in (('per_row_connection', bench_per_row_connection), ('batched', bench_batched)):
+            elapsed = bench(os.path.join(tmp, f"{name}.db"), rows)
+            results[name] = {'rows': count, 'seconds': round(elapsed, 4), 'rows_per_sec': round(count / elapsed, 1)}
+    return results
+
+
+def bench_scrape(client, cycles):
+    """Run scrape cycles against the fake client and time each one"""
+    scraper = StoryScraper()
+    scraper.client = client
+    scraper.headless = True
+    os.makedirs('stories', exist_ok=True)
+
+    latencies = []
+    stories = 0
+    for _ in range(cycles):
+        before = scraper.db.count_stories()
+        start = time.perf_counter()
+        asyncio.run(scraper.scrape_stories())
+        latencies.append(time.perf_counter() - start)
+        stories += scraper.db.count_stories() - before
+    scraper.output.stop()
+    scraper.db.close()
+
+    total = sum(latencies)
+    return {
+        'cycles': cycles,
+        'stories': stories,
+        'stories_per_sec': round(stories / total, 1),
+        'cycle_p50': round(percentile(latencies, 50), 4),
+        'cycle_p95': round(percentile(latencies, 95), 4),
+        'cycle_p99': round(percentile(latencies, 99), 4),
+        'cycle_mean': round(statistics.mean(latencies), 4),
+        'flood_waits': client.floods,
+        'requests': client.requests,
+        'not_modified': client.not_modified,
+    }
+
+
+def bench_exports(rows):
+    """Time the CSV and XLSX exporters over a database of synthetic rows"""
+    db = StoryDatabase('stories.db')
+    for row in make_rows(rows):
+        db.add_story(*row)
+    db.close()
+
+    scraper = StoryScraper()
+    scraper.headless = True
+    results = {}
+    for name, export, ext in (('csv', scraper.export_to_csv, '.csv'), ('xlsx', scraper.export_to_excel, '.xlsx')):
+        existing = set(os.listdir('.'))
+        start = time.perf_counter()
+        export()
+        elapsed = time.perf_counter() - start
+        created = [f for f in set(os.listdir('.')) - existing if f.endswith(ext)]
+        size = sum(os.path.getsize(f) for f in created)
+        results[name] = {
+            'rows': rows,
+            'seconds': round(elapsed, 4),
+            'mb': round(size / (1024 * 1024), 3),
+            'mb_per_sec': round(size / (1024 * 1024) / elapsed, 2),
+        }
+
+    # Cached mode: build the rolling CSV once, then time appending 1% more rows
+    scraper.export_to_csv_cached()
+    added = max(1, rows // 100)
+    for i in range(added):
+        scraper.db.add_story(999999, rows + i, 1731369600 + (rows + i) * 60, f"stories/999999_{rows + i}.jpg")
+    start = time.perf_counter()
+    scraper.export_to_csv_cached()
+    elapsed = time.perf_counter() - start
+    results['csv_cached_append'] = {'rows': added, 'seconds': round(elapsed, 4),
+                                    'rows_per_sec': round(added / elapsed, 1)}
+    scraper.db.close()
+    return results
+
+
+def bench_startup(runs):
+    """Time cold starts of the module import and the stats command in fresh interpreters"""
+    script = os.path.abspath(TGSS.__file__)
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(script))
+    commands = {
+        'import': [sys.executable, '-c', 'import TGSS'],
+        'stats_json': [sys.executable, script, 'stats', '--json'],
+    }
+    results = {}
+    for name, command in commands.items():
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run(command, env=env, check=True, stdout=subprocess.DEVNULL)
+            timings.append(time.perf_counter() - start)
+        results[name] = {
+            'runs': runs,
+            'median': round(statistics.median(timings), 4),
+            'min': round(min(timings), 4),
+        }
+    return results
+
+
+def compare(results, baseline):
+    """Print relative changes against a previous results file"""
+    def walk(current, previous, prefix=''):
+        for key, value in current.items():
+            if key not in previous:
+                continue
+            if isinstance(value, dict):
+                walk(value, previous[key], f"{prefix}{key}.")
+            elif isinstance(value, (int, float)) and previous[key]:
+                change = (value - previous[key]) / previous[key] * 100
+                print(f"  {prefix}{key:<28} {previous[key]:>12} -> {value:<12} ({change:+.1f}%)")
+    print(f"Compared with {baseline}:")
+    with open(baseline, 'r') as f:
+        walk(results, json.load(f))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the TGSS hot paths")
+    parser.add_argument('--peers', type=int, default=50, help="peers per GetAllStories response")
+    parser.add_argument('--stories-per-peer', type=int, default=3, help="stories per peer")
+    parser.add_argument('--cycles', type=int, default=5, help="scrape cycles to run")
+    parser.add_argument('--latency', type=float, default=0.02, help="simulated request latency in seconds")
+    parser.add_argument('--bandwidth', type=float, default=20.0, help="simulated bandwidth in MB/s")
+    parser.add_argument('--flood-rate', type=float, default=0.0, help="fraction of downloads hit by FloodWait")
+    parser.add_argument('--flood-seconds', type=int, default=1, help="FloodWait duration in seconds")
+    parser.add_argument('--post-every', type=int, default=1, help="cycles between new stories; the rest are not modified")
+    parser.add_argument('--page-size', type=int, help="peers per GetAllStories page (default: all in one)")
+    parser.add_argument('--rows', type=int, default=20000, help="rows for the insert and export benchmarks")
+    parser.add_argument('--startup-runs', type=int, default=10, help="interpreter launches per cold-start measurement")
+    parser.add_argument('--output', default='bench_results.json', help="where to save results as JSON")
+    parser.add_argument('--baseline', help="previous results JSON to compare against")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    TGSS.console.quiet = True
+    results = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'args': vars(args),
+        },
+        'inserts': bench_inserts(args.rows),
+    }
+
+    cwd = os.getcwd()
+    output = os.path.abspath(args.output)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            os.makedirs('scrape')
+            os.chdir('scrape')
+            client = FakeTelegramClient(args.peers, args.stories_per_peer, args.latency, args.bandwidth,
+                                        flood_rate=args.flood_rate, flood_seconds=args.flood_seconds,
+                                        post_every=args.post_every, page_size=args.page_size)
+            results['scrape'] = bench_scrape(client, args.cycles)
+
+            os.chdir(tmp)
+            os.makedirs('export')
+            os.chdir('export')
+            results['export'] = bench_exports(args.rows)
+
+            os.chdir(tmp)
+            os.makedirs('startup')
+            os.chdir('startup')
+            results['startup'] = bench_startup(args.startup_runs)
+        finally:
+            os.chdir(cwd)
+    TGSS.console.quiet = False
+
+    for name, result in results['inserts'].items():
+        print(f"insert {name:<20} {result['rows_per_sec']:>12.1f} rows/s")
+    scrape = results['scrape']
+    print(f"scrape {scrape['stories_per_sec']:>12.1f} stories/s  "
+          f"p50 {scrape['cycle_p50']:.3f}s  p95 {scrape['cycle_p95']:.3f}s  p99 {scrape['cycle_p99']:.3f}s  "
+          f"{scrape['not_modified']} of {args.cycles} cycles not modified")
+    for name in ('csv', 'xlsx'):
+        result = results['export'][name]
+        print(f"export {name:<6} {result['mb_per_sec']:>8.2f} MB/s  ({result['rows']} rows in {result['seconds']:.2f}s)")
+    append = results['export']['csv_cached_append']
+    print(f"export cached csv append {append['rows']} rows in {append['seconds']:.3f}s")
+    for name, result in results['startup'].items():
+        print(f"startup {name:<11} {result['median'] * 1000:>8.1f} ms median  ({result['min'] * 1000:.1f} ms min)")
+
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {output}")
+
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
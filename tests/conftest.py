@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import TGSS
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """Run every test in its own directory with console output silenced"""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('stories')
+    TGSS.console.quiet = True
+    yield tmp_path
+    TGSS.console.quiet = False
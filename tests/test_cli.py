@@ -0,0 +1,75 @@
+import sys
+
+import pytest
+
+from TGSS import StoryScraper, configure_scraper, main, parse_args
+
+
+def test_options_before_the_command_are_kept():
+    args = parse_args(['--quiet', '--metrics-port', '9000', 'scrape', '--once'])
+    assert args.quiet is True
+    assert args.metrics_port == 9000
+
+    args = parse_args(['--quiet', 'export', '--format', 'csv'])
+    assert args.quiet is True
+
+
+def test_options_after_the_command_still_apply():
+    args = parse_args(['daemon', '--quiet', '--processing-workers', '4'])
+    assert args.quiet is True
+    assert args.processing_workers == 4
+
+    args = parse_args(['daemon'])
+    assert args.quiet is False
+    assert args.processing_workers == 2
+    assert args.metrics_port is None
+
+
+def test_accounts_rejects_options_workers_cannot_honour(capsys):
+    for option in (['--metrics-port', '9000'], ['--process-media']):
+        with pytest.raises(SystemExit):
+            parse_args(['daemon', '--accounts', 'accounts.json', *option])
+        assert 'cannot be combined with --accounts' in capsys.readouterr().err
+
+
+def test_configure_scraper_applies_storage_options():
+    scraper = StoryScraper()
+    try:
+        configure_scraper(scraper, parse_args(['scrape', '--content-addressed']))
+        assert scraper.content_addressed is True
+    finally:
+        scraper.db.close()
+
+
+def test_configure_scraper_applies_download_limits():
+    scraper = StoryScraper()
+    try:
+        configure_scraper(scraper, parse_args(['--concurrency', '8', 'daemon', '--per-peer', '3']))
+        assert scraper.max_concurrent_downloads == 8
+        assert scraper.max_downloads_per_peer == 3
+    finally:
+        scraper.db.close()
+
+    with pytest.raises(SystemExit):
+        parse_args(['scrape', '--concurrency', '0'])
+
+
+def test_configure_scraper_applies_dedupe_mode():
+    scraper = StoryScraper()
+    try:
+        configure_scraper(scraper, parse_args(['scrape']))
+        assert scraper.dedupe_mode == 'index'
+        configure_scraper(scraper, parse_args(['scrape', '--dedupe-mode', 'lookup']))
+        assert scraper.dedupe_mode == 'lookup'
+    finally:
+        scraper.db.close()
+
+
+def test_failed_commands_exit_non_zero(monkeypatch):
+    monkeypatch.setattr(sys, 'argv', ['TGSS.py', 'scrape', '--once'])
+    with pytest.raises(SystemExit) as exited:
+        main()
+    assert exited.value.code == 1
+
+    monkeypatch.setattr(sys, 'argv', ['TGSS.py', 'export', '--format', 'csv'])
+    main()
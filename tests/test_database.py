@@ -0,0 +1,66 @@
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+from TGSS import StoryDatabase, StoryIndex
+
+LOCAL = timezone(timedelta(hours=2))
+
+
+def epoch(local_time):
+    return int(datetime.strptime(local_time, '%Y-%m-%d %H:%M:%S').replace(tzinfo=LOCAL).timestamp())
+
+
+def test_baseline_database_is_migrated():
+    # The stories table as the original script created it, with local (UTC+2) text times
+    conn = sqlite3.connect('stories.db')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS stories (
+        user_id INTEGER,
+        story_id INTEGER PRIMARY KEY,
+        timestamp TEXT,
+        filename TEXT
+    )
+    ''')
+    legacy = [
+        (1001, 10, '2024-11-11 23:30:00', 'stories/1001_10.jpg'),
+        (1001, 11, '2024-11-12 01:15:00', 'stories/1001_11.mp4'),
+        (2002, 12, '2024-11-12 09:00:00', 'stories/2002_12.jpg'),
+    ]
+    conn.executemany('INSERT INTO stories (user_id, story_id, timestamp, filename) VALUES (?, ?, ?, ?)', legacy)
+    conn.commit()
+    conn.close()
+
+    db = StoryDatabase('stories.db')
+    try:
+        assert db.conn.execute('PRAGMA user_version').fetchone()[0] == StoryDatabase.SCHEMA_VERSION
+
+        rows = db.conn.execute('SELECT user_id, story_id, timestamp, filename FROM stories ORDER BY story_id').fetchall()
+        assert rows == [(user_id, story_id, epoch(posted), filename)
+                        for user_id, story_id, posted, filename in legacy]
+
+        assert db.fetch_statistics() == (3, 2, '2024-11-12 09:00:00', 0)
+        days = db.conn.execute('SELECT day, user_id, stories FROM daily_rollup ORDER BY day, user_id').fetchall()
+        assert days == [('2024-11-11', 1001, 1), ('2024-11-12', 1001, 1), ('2024-11-12', 2002, 1)]
+
+        # The rollups stay current for stories stored after the migration
+        db.add_story(2002, 13, epoch('2024-11-12 10:00:00'), 'stories/2002_13.jpg')
+        assert db.fetch_statistics()[:3] == (4, 2, '2024-11-12 10:00:00')
+    finally:
+        db.close()
+
+    db = StoryDatabase('stories.db')
+    try:
+        assert db.count_stories() == 4
+    finally:
+        db.close()
+
+
+def test_index_memory_counts_the_keys_in_its_sets():
+    index = StoryIndex().load([(1, 1), (2, 2)])
+    empty = index.memory_usage()
+    for story_id in range(100):
+        index.add(3, story_id)
+    index.add(1 << 45, 1)
+    # Every added key is an int object of at least 28 bytes on top of its set slot
+    assert index.memory_usage() - empty >= 101 * 28
+    assert StoryIndex.estimate_memory(len(index)) == len(index) * 8
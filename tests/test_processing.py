@@ -0,0 +1,72 @@
+import asyncio
+import os
+import shutil
+import subprocess
+import time
+
+import pytest
+
+from TGSS import MediaProcessor, Metrics, StoryDatabase, process_media_file
+
+Image = pytest.importorskip('PIL.Image')
+
+
+def make_image(path, shade):
+    image = Image.new('RGB', (64, 48))
+    for x in range(64):
+        for y in range(48):
+            image.putpixel((x, y), ((x * shade) % 256, y * 5, shade))
+    image.save(path)
+
+
+def test_processing_past_the_queue_size_defers_then_finishes(workdir):
+    filenames = []
+    for i in range(5):
+        filename = os.path.join('stories', f"story_{i}.jpg")
+        make_image(filename, 10 + i * 40)
+        filenames.append(filename)
+
+    db = StoryDatabase('stories.db')
+    metrics = Metrics()
+    processor = MediaProcessor(db, metrics, workers=1, queue_size=2)
+
+    async def process():
+        for filename in filenames:
+            processor.submit(filename)
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            pending = db.conn.execute(
+                "SELECT COUNT(*) FROM media_processing WHERE status != 'done'"
+            ).fetchone()[0]
+            done = db.conn.execute("SELECT COUNT(*) FROM media_processing").fetchone()[0]
+            if done == len(filenames) and not pending:
+                break
+            await asyncio.sleep(0.05)
+        await processor.close()
+
+    try:
+        asyncio.run(process())
+        assert metrics.counters['processing_deferred'] == 3
+
+        rows = db.conn.execute('SELECT filename, status, thumbnail, phash FROM media_processing').fetchall()
+        assert sorted(row[0] for row in rows) == sorted(filenames)
+        for _, status, thumbnail, phash in rows:
+            assert status == 'done'
+            assert os.path.exists(thumbnail)
+            assert len(phash) == 16
+        assert len({row[3] for row in rows}) > 1
+    finally:
+        db.close()
+
+
+@pytest.mark.skipif(not shutil.which('ffmpeg'), reason="ffmpeg is not installed")
+def test_clip_shorter_than_a_second_gets_a_thumbnail(workdir):
+    clip = os.path.join('stories', 'short.mp4')
+    subprocess.run(['ffmpeg', '-v', 'error', '-y', '-f', 'lavfi', '-i', 'testsrc=duration=0.5:size=160x120:rate=10',
+                    '-pix_fmt', 'yuv420p', clip], check=True)
+
+    result = process_media_file(clip, os.path.join('stories', 'thumbnails'))
+
+    assert 'error' not in result
+    assert os.path.exists(result['thumbnail'])
+    assert len(result['phash']) == 16
@@ -0,0 +1,164 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+
+from benchmark import FakeClientFactory, FakeTelegramClient
+from TGSS import PeerAssigner, StoryDatabase, StoryScraper, run_accounts
+
+
+def make_scraper(client):
+    scraper = StoryScraper()
+    scraper.client = client
+    scraper.headless = True
+    return scraper
+
+
+def test_unchanged_stories_are_not_fetched_again():
+    client = FakeTelegramClient(peers=5, stories_per_peer=1, latency=0, bandwidth=1000,
+                                post_every=2, page_size=2)
+    scraper = make_scraper(client)
+    try:
+        for _ in range(3):
+            assert asyncio.run(scraper.scrape_stories())
+        # Three pages for each of the two new sets, one not-modified poll in between
+        assert client.requests == 7
+        assert client.not_modified == 1
+        assert scraper.db.count_stories() == 10
+    finally:
+        scraper.output.stop()
+        scraper.db.close()
+
+
+def test_story_larger_than_cycle_budget_is_still_downloaded():
+    client = FakeTelegramClient(peers=2, stories_per_peer=2, latency=0, bandwidth=1000,
+                                video_size=3 * 1024 * 1024, video_ratio=1.0)
+    scraper = make_scraper(client)
+    scraper.cycle_byte_budget = 2 * 1024 * 1024
+    try:
+        for _ in range(3):
+            asyncio.run(scraper.scrape_stories())
+            assert scraper.transfer['bytes'] > 0
+        assert scraper.db.count_stories() >= 3
+    finally:
+        scraper.output.stop()
+        scraper.db.close()
+
+
+def test_concurrent_downloads_stay_within_cycle_budget():
+    client = FakeTelegramClient(peers=5, stories_per_peer=2, latency=0.01, bandwidth=100,
+                                video_size=3 * 1024 * 1024, video_ratio=1.0)
+    scraper = make_scraper(client)
+    scraper.cycle_byte_budget = 10 * 1024 * 1024
+    scraper.max_concurrent_downloads = 5
+    try:
+        assert asyncio.run(scraper.scrape_stories())
+        assert 0 < scraper.transfer['bytes'] <= scraper.cycle_byte_budget
+        assert scraper.transfer['reserved'] == 0
+    finally:
+        scraper.output.stop()
+        scraper.db.close()
+
+
+def test_deferred_stories_that_expire_later_are_counted():
+    client = FakeTelegramClient(peers=3, stories_per_peer=2, latency=0, bandwidth=1000,
+                                video_size=3 * 1024 * 1024, video_ratio=1.0)
+    scraper = make_scraper(client)
+    scraper.cycle_byte_budget = 4 * 1024 * 1024
+    scraper.max_concurrent_downloads = 1
+    try:
+        assert asyncio.run(scraper.scrape_stories())
+        stored = scraper.db.count_stories()
+        missed = scraper.db.conn.execute('SELECT COUNT(*) FROM missed_stories').fetchone()[0]
+        assert stored and missed == 6 - stored
+
+        # Nothing has expired yet; once every story is past its expiry the ones
+        # still not stored are counted, and only once.
+        assert scraper.db.expire_missed_stories(0) == 0
+        assert scraper.db.expire_missed_stories(2 ** 40) == missed
+        assert scraper.db.expire_missed_stories(2 ** 40) == 0
+    finally:
+        scraper.output.stop()
+        scraper.db.close()
+
+
+def wait_for_lines(path, count, timeout=60):
+    """Wait until a file has at least count lines, returning whether it got there in time"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if os.path.exists(path):
+            with open(path) as f:
+                if sum(1 for _ in f) >= count:
+                    return True
+        time.sleep(0.1)
+    return False
+
+
+def test_accounts_following_the_same_peers_download_each_story_once(workdir):
+    log = workdir / 'downloads.log'
+    factory = FakeClientFactory(peers=20, stories_per_peer=3, latency=0.01, bandwidth=1000,
+                                download_log=str(log))
+    accounts = [
+        {'name': name, 'session': name, 'api_id': '1', 'api_hash': 'hash', 'phone_number': '+1'}
+        for name in ('first', 'second')
+    ]
+    stop_event = multiprocessing.get_context('spawn').Event()
+    coordinator = threading.Thread(target=run_accounts, args=(accounts, 1),
+                                   kwargs={'client_factory': factory, 'stop_event': stop_event})
+    coordinator.start()
+    # Both accounts see all 20 peers, so the first cycle is done once they have
+    # downloaded the 60 stories between them.
+    finished = wait_for_lines(log, 60)
+    stop_event.set()
+    coordinator.join(timeout=60)
+    assert not coordinator.is_alive()
+    assert finished
+
+    downloads = log.read_text().split()
+    assert downloads
+    assert len(downloads) == len(set(downloads))
+    db = StoryDatabase('stories.db')
+    try:
+        assert db.count_stories() == len(downloads)
+        owners = db.conn.execute('SELECT COUNT(DISTINCT account) FROM account_peers').fetchone()[0]
+        assert owners == 2
+    finally:
+        db.close()
+
+
+def test_released_peers_reset_the_survivors_sync_state():
+    db = StoryDatabase('stories.db')
+    try:
+        assigner = PeerAssigner(['first', 'second'], db)
+        assert assigner.submit('first', 1, [1, 2, 3]) == []
+        answers = assigner.submit('second', 1, [1, 2, 3])
+        owned = {account: set(peers) for account, _, peers in answers}
+        assert owned['first'].isdisjoint(owned['second'])
+        assert owned['first'] | owned['second'] == {1, 2, 3}
+
+        db.set_sync_state('all_stories:first', 'advanced')
+        assigner.release('second')
+        assert db.get_sync_state('all_stories:first') is None
+        # A state from a cycle assigned before the release must not be saved again
+        assert not assigner.accept_sync_state('all_stories:first')
+
+        (_, _, peers), = assigner.submit('first', 2, [1, 2, 3])
+        assert set(peers) == {1, 2, 3}
+        assert assigner.accept_sync_state('all_stories:first')
+    finally:
+        db.close()
+
+
+def test_media_locks_do_not_outlive_a_cycle():
+    client = FakeTelegramClient(peers=3, stories_per_peer=2, latency=0, bandwidth=1000)
+    scraper = make_scraper(client)
+    scraper.content_addressed = True
+    try:
+        for _ in range(2):
+            assert asyncio.run(scraper.scrape_stories())
+            assert len(scraper.media_locks) <= 6
+        assert scraper.db.count_stories() == 12
+    finally:
+        scraper.output.stop()
+        scraper.db.close()